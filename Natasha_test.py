@@ -4,6 +4,7 @@ from natasha import (
     NewsNERTagger,
     Doc
 )
+from natasha.doc import DocSpan
 from examples import example_1, example_2, example_3, example_4
 
 # 1. Инициализация инструментов
@@ -11,12 +12,35 @@ segmenter = Segmenter()
 emb = NewsEmbedding()
 ner_tagger = NewsNERTagger(emb)
 
-# 2. Текст для анализа
-text = example_1
-examples = [example_1, example_2, example_3, example_4]
-for i in examples:
-    print(i)
-    doc = Doc(i)
-    doc.segment(segmenter)
-    doc.tag_ner(ner_tagger)
-    print(doc.spans)
+
+def process_batch(texts):
+    """Прогоняет все тексты через NER одним батчем"""
+    docs = [Doc(text) for text in texts]
+    for doc in docs:
+        doc.segment(segmenter)
+
+    # У Natasha нет nlp.pipe(), но Slovnet-теггер умеет map() с батчами,
+    # поэтому вместо doc.tag_ner() по одному тексту размечаем все сразу
+    tagged = [doc for doc in docs if doc.text.strip()]
+    markups = ner_tagger.map([doc.text for doc in tagged])
+    for doc, markup in zip(tagged, markups):
+        doc.spans = [
+            DocSpan(span.start, span.stop, span.type, doc.text[span.start:span.stop])
+            for span in markup.spans
+        ]
+        doc.envelop_span_tokens()
+        doc.envelop_sent_spans()
+
+    for doc in docs:
+        if not doc.text.strip():
+            doc.spans = []
+
+    return docs
+
+
+if __name__ == "__main__":
+    # 2. Тексты для анализа
+    examples = [example_1, example_2, example_3, example_4]
+    for doc in process_batch(examples):
+        print(doc.text)
+        print(doc.spans)
@@ -1,10 +1,34 @@
+import functools
+import itertools
+import json
+import os
+import sys
+from collections import defaultdict
+from operator import attrgetter
+from types import MappingProxyType
+import regex
 import spacy
-from presidio_analyzer import AnalyzerEngine, RecognizerRegistry, PatternRecognizer, Pattern
-from presidio_analyzer.nlp_engine import NlpEngineProvider
+from presidio_analyzer import (
+    AnalyzerEngine, RecognizerRegistry, PatternRecognizer, Pattern, EntityRecognizer, RecognizerResult
+)
+from presidio_analyzer.nlp_engine import NlpEngineProvider, NoOpNlpEngine
+from presidio_analyzer.predefined_recognizers import SpacyRecognizer
 from presidio_anonymizer import AnonymizerEngine
-from presidio_anonymizer.entities import OperatorConfig
+from presidio_anonymizer.entities import EngineResult, OperatorConfig, OperatorResult
+from presidio_anonymizer.operators import Operator, OperatorType
 import time
 
+# Восстановление текста общее с сервисами
+from placeholders import restore_text as restore
+
+# Hyperscan (опционально) - DFA-сканер для цифровых ПДн
+try:
+    import hyperscan
+    HYPERSCAN_AVAILABLE = True
+except ImportError:
+    print("Hyperscan не установлен, используется re. Установите: pip install hyperscan")
+    HYPERSCAN_AVAILABLE = False
+
 # Предположим, example_4 импортируется или определен здесь
 example_4 = "Меня зовут Иван Иванов, мой ИНН 7712345678, телефон +7 900 123-45-67. Прописан: г. Москва, ул. Ленина, дом 5, кв. 12. Паспорт: 4510 123456"
 
@@ -12,138 +36,506 @@ configuration = {
     "nlp_engine_name": "spacy",
     "models": [{"lang_code": "ru", "model_name": "ru_core_news_lg"}]
 }
-provider = NlpEngineProvider(nlp_configuration=configuration)
-nlp_engine = provider.create_engine()
 
-registry = RecognizerRegistry()
-registry.load_predefined_recognizers(nlp_engine=nlp_engine)
+# Регулярные выражения собраны на уровне модуля, чтобы не дублировать строки
+# в каждом рекогнайзере. Флаг IGNORECASE уже входит в GLOBAL_REGEX_FLAGS,
+# поэтому инлайн-флаг (?i) в самих выражениях не нужен.
+GLOBAL_REGEX_FLAGS = regex.DOTALL | regex.MULTILINE | regex.IGNORECASE
 
 # 1. Регулярное выражение для российских адресов
 # Ищет сокращения: г, ул, пр-т, наб, пер, д, корп, стр, кв и последующие названия/номера
-address_recognizer = PatternRecognizer(
-    supported_entity="ADDRESS",
-    name="RU_ADDRESS",
-    supported_language="ru",
-    patterns=[
-        Pattern(
-            name="address",
-            regex=r"(?i)\b(?:г|ул|пр-т|проспект|наб|пер|д|дом|корп|стр|кв|обл|район)\.?\s+[А-ЯЁа-яё0-9\-\.]+(?:[\s,]+(?:г|ул|пр-т|проспект|наб|пер|д|дом|корп|стр|кв|обл|район)\.?\s+[А-ЯЁа-яё0-9\-\.]+)*",
-            score=0.6
-        )
-    ]
-)
+ADDRESS_REGEX = r"\b(?:г|ул|пр-т|проспект|наб|пер|д|дом|корп|стр|кв|обл|район)\.?\s+[А-ЯЁа-яё0-9\-\.]+(?:[\s,]+(?:г|ул|пр-т|проспект|наб|пер|д|дом|корп|стр|кв|обл|район)\.?\s+[А-ЯЁа-яё0-9\-\.]+)*"
+PHONE_REGEX = r'(\+7|8|7)[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}'
+INN_REGEX = r'\b\d{10}\b|\b\d{12}\b'
+PASSPORT_REGEX = r"(?<!\d)(?:паспорт\s*)?(?:серия\s*)?(?:\d{2}\s?\d{2}|\d{4})[\s\-]?(?:номер\s*)?\d{6}(?!\d)"
 
-phone_recognizer = PatternRecognizer(
-    supported_entity="PHONE_NUMBER",
-    name="RU_PHONE",
-    supported_language="ru",
-    patterns=[
-        Pattern(name="phone", regex=r'(\+7|8|7)[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}', score=0.8)]
-)
+# имя рекогнайзера -> (сущность, имя паттерна, регулярка, score)
+RECOGNIZER_SPECS = {
+    "RU_ADDRESS": ("ADDRESS", "address", ADDRESS_REGEX, 0.6),
+    "RU_PHONE": ("PHONE_NUMBER", "phone", PHONE_REGEX, 0.8),
+    "RU_INN": ("INN", "inn", INN_REGEX, 0.8),
+    "RU_PASSPORT": ("PASSPORT", "passport", PASSPORT_REGEX, 0.95),
+}
 
-inn_recognizer = PatternRecognizer(
-    supported_entity="INN",
-    name="RU_INN",
-    supported_language="ru",
-    patterns=[Pattern(name="inn", regex=r'\b\d{10}\b|\b\d{12}\b', score=0.8)]
+
+@functools.lru_cache(maxsize=None)
+def get_recognizer(name):
+    """Создает рекогнайзер один раз и сразу компилирует его паттерн"""
+    entity, pattern_name, pattern_regex, score = RECOGNIZER_SPECS[name]
+    pattern = Pattern(name=pattern_name, regex=pattern_regex, score=score)
+    # Presidio компилирует паттерн лениво при первом analyze();
+    # делаем это заранее с теми же флагами, чтобы первый запрос не платил за компиляцию
+    pattern.compiled_regex = regex.compile(pattern.regex, flags=GLOBAL_REGEX_FLAGS)
+    pattern.compiled_with_flags = GLOBAL_REGEX_FLAGS
+    return PatternRecognizer(
+        supported_entity=entity,
+        name=name,
+        supported_language="ru",
+        patterns=[pattern],
+        global_regex_flags=GLOBAL_REGEX_FLAGS,
+    )
+
+
+# Запасной вариант без Hyperscan: ИНН, телефон и паспорт одним рекогнайзером.
+# Каждая регулярка идет своим finditer без наложений, как у отдельных
+# PatternRecognizer, поэтому и совпадения те же. Пересечения разных типов
+# (10 цифр подходят и под ИНН, и под паспорт) разрешает Presidio по score
+DIGIT_PII_SPECS = (
+    ("PASSPORT", "RU_PASSPORT"),
+    ("INN", "RU_INN"),
+    ("PHONE_NUMBER", "RU_PHONE"),
 )
 
-passport_recognizer = PatternRecognizer(
-    supported_entity="PASSPORT",
-    name="RU_PASSPORT",
-    supported_language="ru",
-    patterns=[
-        Pattern(
-            name="passport",
-            regex=r"(?<!\d)(?:паспорт\s*)?(?:серия\s*)?(?:\d{2}\s?\d{2}|\d{4})[\s\-]?(?:номер\s*)?\d{6}(?!\d)",
-            score=0.95
+# сущность -> (скомпилированная регулярка, score)
+DIGIT_PII_PATTERNS = {
+    entity: (regex.compile(RECOGNIZER_SPECS[name][2], flags=GLOBAL_REGEX_FLAGS), RECOGNIZER_SPECS[name][3])
+    for entity, name in DIGIT_PII_SPECS
+}
+
+
+class DigitPiiRecognizer(EntityRecognizer):
+    """Ищет ИНН, телефоны и паспорта регулярками из DIGIT_PII_PATTERNS"""
+
+    def __init__(self, name="RU_DIGIT_PII"):
+        super().__init__(
+            supported_entities=list(DIGIT_PII_PATTERNS),
+            name=name,
+            supported_language="ru",
         )
-    ]
-)
 
-registry.add_recognizer(address_recognizer)
-registry.add_recognizer(phone_recognizer)
-registry.add_recognizer(inn_recognizer)
-registry.add_recognizer(passport_recognizer)
+    def load(self):
+        pass
+
+    def find(self, text, entities):
+        results = []
+        for entity in entities:
+            compiled, score = DIGIT_PII_PATTERNS[entity]
+            for match in compiled.finditer(text):
+                results.append(RecognizerResult(
+                    entity_type=entity, start=match.start(), end=match.end(), score=score
+                ))
+        return results
+
+    def analyze(self, text, entities, nlp_artifacts=None):
+        return self.find(text, [entity for entity in DIGIT_PII_PATTERNS if entity in entities])
+
+
+# Hyperscan только отбирает, какие регулярки запускать: на каждую сущность
+# одно выражение, которое находится в тексте всегда, когда есть ее совпадение
+# (ИНН - 10 цифр подряд, телефон - хвост из 7 цифр, паспорт - 6 цифр подряд).
+# Сами совпадения ищут исходные регулярки из DIGIT_PII_PATTERNS: lookaround,
+# \b и регистр кириллицы в ключевых словах Hyperscan не повторить один в один,
+# а на тексте без цифр до regex дело не доходит.
+# Адреса остаются на re: им нужны \b и кириллические классы в UCP-режиме.
+# id выражения в базе Hyperscan -> (сущность, выражение-фильтр)
+HS_EXPRESSIONS = {
+    1: ("INN", r"\d{10}"),
+    2: ("PHONE_NUMBER", r"\d{3}\D?\d{2}\D?\d{2}"),
+    3: ("PASSPORT", r"\d{6}"),
+}
+
+
+class HyperscanRecognizer(DigitPiiRecognizer):
+    """Ищет ИНН, телефоны и паспорта, отсеивая лишние регулярки Hyperscan"""
+
+    def __init__(self):
+        self.database = None
+        super().__init__(name="RU_DIGIT_PII_HS")
+
+    def load(self):
+        ids = list(HS_EXPRESSIONS)
+        self.database = hyperscan.Database()
+        # UCP - чтобы \d, как и в regex, включал не только ASCII-цифры.
+        # SINGLEMATCH - для отбора хватает первого срабатывания выражения
+        self.database.compile(
+            expressions=[HS_EXPRESSIONS[i][1].encode("utf-8") for i in ids],
+            ids=ids,
+            elements=len(ids),
+            flags=[hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_SINGLEMATCH] * len(ids),
+        )
+
+    def analyze(self, text, entities, nlp_artifacts=None):
+        found = set()
+
+        def on_match(expression_id, start, end, flags, context):
+            found.add(HS_EXPRESSIONS[expression_id][0])
+
+        self.database.scan(text.encode("utf-8"), match_event_handler=on_match)
+        return self.find(text, [entity for entity in DIGIT_PII_PATTERNS if entity in found and entity in entities])
+
+
+# Модель ru_core_news_lg весит ~500 МБ, поэтому движки создаются лениво
+# при первом обращении и кешируются на весь процесс
+
+# Presidio берет из spaCy только doc.ents, поэтому в пайплайне
+# оставляем tok2vec и ner, а остальные компоненты отключаем
+UNUSED_SPACY_PIPES = ("tagger", "morphologizer", "parser", "attribute_ruler", "lemmatizer")
+
+
+# Перенос ner на GPU включается через ANONIMISER_GPU=1 (нужен pip install spacy[cuda12x]).
+# Для нескольких GPU запускайте по процессу на карту с CUDA_VISIBLE_DEVICES=<номер>
+USE_GPU = os.getenv("ANONIMISER_GPU", "0") == "1"
+
+
+@functools.lru_cache(maxsize=1)
+def get_nlp_engine():
+    # GPU нужно выбрать до загрузки модели, иначе веса останутся на CPU
+    if USE_GPU and not spacy.prefer_gpu():
+        print("GPU недоступен, spaCy работает на CPU")
+
+    provider = NlpEngineProvider(nlp_configuration=configuration)
+    nlp_engine = provider.create_engine()
+
+    nlp = nlp_engine.nlp["ru"]
+    for pipe_name in UNUSED_SPACY_PIPES:
+        if pipe_name in nlp.pipe_names:
+            nlp.disable_pipe(pipe_name)
+
+    return nlp_engine
+
+
+def add_regex_recognizers(registry):
+    registry.add_recognizer(get_recognizer("RU_ADDRESS"))
+    if HYPERSCAN_AVAILABLE:
+        registry.add_recognizer(HyperscanRecognizer())
+    else:
+        registry.add_recognizer(DigitPiiRecognizer())
+
+
+class EntityAnalyzerEngine(AnalyzerEngine):
+    """AnalyzerEngine, который не гоняет spaCy, если NER не нужен.
+
+    Реестр Presidio и так отбирает распознаватели по сущностям, но
+    process_text вызывается всегда. Если среди запрошенных сущностей
+    нет тех, что дает SpacyRecognizer, подставляем пустые артефакты.
+    """
+
+    # SpacyRecognizer заявляет и PHONE_NUMBER, и DATE_TIME, но модель
+    # ru_core_news_lg размечает только PER, LOC и ORG
+    NER_ENTITIES = frozenset(("PERSON", "LOCATION", "ORGANIZATION"))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._by_entity = defaultdict(list)
+        for recognizer in self.registry.get_recognizers(language="ru", all_fields=True):
+            for entity in recognizer.get_supported_entities():
+                self._by_entity[entity].append(recognizer)
+        self._no_op_engine = NoOpNlpEngine(models=[{"lang_code": "ru", "model_name": "no_op"}])
+        self._no_op_engine.load()
+
+    def needs_nlp(self, entities):
+        if not entities:
+            return True
+        return any(
+            isinstance(recognizer, SpacyRecognizer)
+            for entity in self.NER_ENTITIES.intersection(entities)
+            for recognizer in self._by_entity[entity]
+        )
+
+    def analyze(self, text, language, entities=None, nlp_artifacts=None, **kwargs):
+        if nlp_artifacts is None and not self.needs_nlp(entities):
+            nlp_artifacts = self._no_op_engine.process_text(text, language)
+        return super().analyze(
+            text=text, language=language, entities=entities, nlp_artifacts=nlp_artifacts, **kwargs
+        )
+
+
+@functools.lru_cache(maxsize=1)
+def get_analyzer():
+    nlp_engine = get_nlp_engine()
+
+    registry = RecognizerRegistry()
+    registry.load_predefined_recognizers(nlp_engine=nlp_engine)
+    add_regex_recognizers(registry)
 
-analyzer = AnalyzerEngine(nlp_engine=nlp_engine, registry=registry)
-anonymizer_engine = AnonymizerEngine()
+    return EntityAnalyzerEngine(nlp_engine=nlp_engine, registry=registry)
+
+
+@functools.lru_cache(maxsize=1)
+def get_regex_analyzer():
+    """Анализатор только на регулярках: spaCy не загружается и не запускается"""
+    registry = RecognizerRegistry()
+    add_regex_recognizers(registry)
+
+    nlp_engine = NoOpNlpEngine(models=[{"lang_code": "ru", "model_name": "no_op"}])
+    return AnalyzerEngine(nlp_engine=nlp_engine, registry=registry)
+
+
+class PlaceholderOperator(Operator):
+    """Заменяет сущность меткой из AnonymizationManager.
+
+    Presidio сам кладет entity_type в params оператора, поэтому хватает
+    одного оператора на все типы вместо отдельной лямбды на каждый.
+    """
+
+    def operate(self, text=None, params=None):
+        return params["manager"].get_replacement(text, params["entity_type"])
+
+    def validate(self, params):
+        pass
+
+    def operator_name(self):
+        return "placeholder"
+
+    def operator_type(self):
+        return OperatorType.Anonymize
+
+
+class JoinAnonymizerEngine(AnonymizerEngine):
+    """AnonymizerEngine, собирающий итоговый текст за один проход.
+
+    TextReplaceBuilder пересобирает всю строку на каждую сущность,
+    здесь куски копятся в списке и склеиваются один раз. Разрешение
+    конфликтов и слияние соседних сущностей остаются от Presidio.
+
+    Переопределяет приватный EngineBase._operate, поэтому версия
+    presidio-anonymizer закреплена в requirements.txt
+    """
+
+    def _operate(self, text, pii_entities, operators_metadata, operator_type, **operator_kwargs):
+        # operator_kwargs, как и в EngineBase._operate, операторам не передаются
+        engine_result = EngineResult()
+        parts = []
+        tail_len = 0
+        cursor = len(text)
+        # Идем с конца, как Presidio, чтобы нумерация меток не поменялась
+        for entity in sorted(pii_entities, reverse=True):
+            config = operators_metadata.get(entity.entity_type) or operators_metadata["DEFAULT"]
+            operator = self.operators_factory.create_operator_class(config.operator_name, operator_type)
+            params = config.params.copy()
+            params["entity_type"] = entity.entity_type
+            operator.validate(params=params)
+            changed_text = operator.operate(params=params, text=text[entity.start:entity.end])
+
+            tail = text[min(entity.end, cursor):cursor]
+            parts.append(tail)
+            parts.append(changed_text)
+            tail_len += len(tail) + len(changed_text)
+            cursor = entity.start
+
+            # Как у Presidio: позиция считается от конца текста
+            # и нормализуется, когда известна итоговая длина
+            engine_result.add_item(OperatorResult(
+                0, tail_len, entity.entity_type, changed_text, config.operator_name
+            ))
+        parts.append(text[:cursor])
+        parts.reverse()
+
+        engine_result.set_text("".join(parts))
+        engine_result.normalize_item_indexes()
+        return engine_result
+
+
+@functools.lru_cache(maxsize=1)
+def get_anonymizer():
+    anonymizer_engine = JoinAnonymizerEngine()
+    anonymizer_engine.add_anonymizer(PlaceholderOperator)
+    return anonymizer_engine
+
+
+# Метки для замены общие для всех менеджеров, поэтому словарь один на модуль.
+# Ключи и значения интернированы: поиск по entity_type от Presidio
+# сравнивает строки по указателю
+_LABEL_MAP = {sys.intern(entity): sys.intern(label) for entity, label in (
+    # PER модели Presidio уже переводит в PERSON
+    ("PERSON", "ИМЯ"),
+    ("PHONE_NUMBER", "ТЕЛЕФОН"),
+    ("INN", "ИНН"),
+    ("PASSPORT", "ПАСПОРТ"),
+    ("LOCATION", "АДРЕС"),  # Для встроенных локаций spaCy
+    ("ADDRESS", "АДРЕС"),  # Для нашего кастомного рекогнайзера
+)}
 
 
 class AnonymizationManager:
+    # Менеджер создается на каждый текст, __slots__ убирает __dict__ у экземпляров
+    __slots__ = ("counters", "mapping", "_seen")
+
+    # Только для чтения снаружи, сам get_replacement берет _LABEL_MAP напрямую
+    label_map = MappingProxyType(_LABEL_MAP)
+
     def __init__(self):
-        self.counters = {}
+        # Для каждой метки свой счетчик, начинающийся с 1
+        self.counters = defaultdict(lambda: itertools.count(1))
         self.mapping = {}
-        self.label_map = {
-            "PERSON": "ИМЯ",
-            "PER": "ИМЯ",
-            "PHONE_NUMBER": "ТЕЛЕФОН",
-            "INN": "ИНН",
-            "PASSPORT": "ПАСПОРТ",
-            "LOCATION": "АДРЕС",  # Для встроенных локаций spaCy
-            "ADDRESS": "АДРЕС"  # Для нашего кастомного рекогнайзера
-        }
+        # Обратный индекс (метка, исходный текст) -> метка-замена,
+        # чтобы повторы одной и той же сущности получали одну метку
+        self._seen = {}
 
     def get_replacement(self, original_text, entity_type):
-        ru_label = self.label_map.get(entity_type, entity_type)
+        ru_label = _LABEL_MAP.get(entity_type, entity_type)
 
-        if ru_label not in self.counters:
-            self.counters[ru_label] = 1
+        key = (ru_label, original_text)
+        placeholder = self._seen.get(key)
+        if placeholder is not None:
+            return placeholder
 
-        placeholder = f"{{{ru_label}_{self.counters[ru_label]}}}"
+        placeholder = f"{{{ru_label}_{next(self.counters[ru_label])}}}"
+        self._seen[key] = placeholder
+        self.mapping[placeholder] = original_text
+        return placeholder
 
-        # Чтобы не дублировать одни и те же сущности в маппинге
-        if placeholder not in self.mapping:
-            self.mapping[placeholder] = original_text
-            self.counters[ru_label] += 1
 
-        return placeholder
+# Добавляем LOCATION и ADDRESS в список сущностей
+ENTITIES = ["PERSON", "PHONE_NUMBER", "INN", "PASSPORT", "LOCATION", "ADDRESS"]
+# Сущности, которые находят регулярки без spaCy
+REGEX_ENTITIES = ["PHONE_NUMBER", "INN", "PASSPORT", "ADDRESS"]
 
+# Режим lazy spaCy: при массовой загрузке ищем только регулярные сущности,
+# а spaCy (имена и локации) запускаем только там, где он действительно нужен
+LAZY_SPACY = os.getenv("ANONIMISER_LAZY_SPACY", "0") == "1"
 
-manager = AnonymizationManager()
+# Размер батча для nlp.pipe(), оптимум обычно в диапазоне 45-85.
+# Если SPACY_BATCH_SIZE не задан, batch_size и n_process подбираются
+# замером на первом большом батче и кешируются в PIPE_TUNING_PATH
+SPACY_BATCH_SIZE = int(os.getenv("SPACY_BATCH_SIZE", "0")) or None
+DEFAULT_PIPE_PARAMS = (64, 1)
 
-text = example_4
+PIPE_TUNING_PATH = os.path.join(os.path.expanduser("~"), ".cache", "anonimiser", "pipe_tuning.json")
+# Подбор запускается только на батче от PIPE_TUNING_MIN_TEXTS текстов, а замеряется
+# на первых PIPE_TUNING_SAMPLE из них. Новые варианты перестают пробовать, когда
+# замеры заняли больше PIPE_TUNING_BUDGET секунд
+PIPE_TUNING_MIN_TEXTS = 200
+PIPE_TUNING_SAMPLE = 64
+PIPE_TUNING_BUDGET = 2.0
+PIPE_TUNING_BATCH_SIZES = (16, 32, 64, 128)
 
-# Добавляем LOCATION и ADDRESS в список сущностей
-results = analyzer.analyze(
-    text=text,
-    language='ru',
-    entities=["PERSON", "PER", "PHONE_NUMBER", "INN", "PASSPORT", "LOCATION", "ADDRESS"]
-)
+_pipe_params = None
 
-# Сортировка для корректной работы анонимизатора
-results = sorted(results, key=lambda x: x.start)
 
-time_start = time.time()
+def _pipe_tuning_host():
+    """Параметры замера, при смене которых кеш становится неактуальным"""
+    return {"cpu": os.cpu_count(), "model": configuration["models"][0]["model_name"]}
 
-# Формируем операторы динамически на основе label_map
-operators = {
-    entity: OperatorConfig("custom", {"lambda": lambda x, et=entity: manager.get_replacement(x, et)})
-    for entity in ["PERSON", "PER", "PHONE_NUMBER", "INN", "PASSPORT", "LOCATION", "ADDRESS"]
-}
 
-anonymized_result = anonymizer_engine.anonymize(
-    text=text,
-    analyzer_results=results,
-    operators=operators
-)
-time_end = time.time()
+def load_pipe_tuning():
+    try:
+        with open(PIPE_TUNING_PATH, encoding="utf-8") as f:
+            tuning = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if any(tuning.get(key) != value for key, value in _pipe_tuning_host().items()):
+        return None
+    return tuning["bs"], tuning["np"]
+
+
+def _time_pipe(nlp_engine, texts, batch_size, n_process):
+    start = time.perf_counter()
+    for _ in nlp_engine.process_batch(
+        texts, language='ru', batch_size=batch_size, n_process=n_process
+    ):
+        pass
+    return time.perf_counter() - start
+
+
+def tune_pipe(texts):
+    """Замеряет nlp.pipe() на выборке текстов и возвращает лучшие (batch_size, n_process)"""
+    nlp_engine = get_nlp_engine()
+    sample = texts[:PIPE_TUNING_SAMPLE]
+
+    # Прогрев: первый вызов модели медленнее остальных и не должен
+    # достаться первому варианту
+    _time_pipe(nlp_engine, sample[:PIPE_TUNING_BATCH_SIZES[0]], PIPE_TUNING_BATCH_SIZES[0], 1)
+
+    deadline = time.perf_counter() + PIPE_TUNING_BUDGET
+    timings = {}
+    for batch_size in PIPE_TUNING_BATCH_SIZES:
+        if timings and time.perf_counter() > deadline:
+            break
+        timings[(batch_size, 1)] = _time_pipe(nlp_engine, sample, batch_size, 1)
+
+    # Каждый процесс грузит свою копию модели, поэтому несколько процессов
+    # пробуем только с лучшим batch_size. На GPU модель одна, процессы не нужны
+    if not USE_GPU:
+        batch_size = min(timings, key=timings.get)[0]
+        cpu_count = os.cpu_count() or 1
+        for n_process in sorted({max(1, cpu_count // 2), max(1, cpu_count - 1)} - {1}):
+            if time.perf_counter() > deadline:
+                break
+            timings[(batch_size, n_process)] = _time_pipe(nlp_engine, sample, batch_size, n_process)
+    batch_size, n_process = min(timings, key=timings.get)
+
+    try:
+        os.makedirs(os.path.dirname(PIPE_TUNING_PATH), exist_ok=True)
+        with open(PIPE_TUNING_PATH, "w", encoding="utf-8") as f:
+            json.dump({"bs": batch_size, "np": n_process, **_pipe_tuning_host()}, f)
+    except OSError as e:
+        print(f"Не удалось сохранить подбор параметров nlp.pipe(): {e}")
+
+    return batch_size, n_process
+
+
+def get_pipe_params(texts):
+    """(batch_size, n_process) для nlp.pipe(): из окружения, кеша или замера"""
+    global _pipe_params
+    if SPACY_BATCH_SIZE:
+        return SPACY_BATCH_SIZE, 1
+    if _pipe_params is None:
+        _pipe_params = load_pipe_tuning()
+    if _pipe_params is None:
+        # На маленьком батче замер ничего не скажет, берем значения по умолчанию
+        if len(texts) < PIPE_TUNING_MIN_TEXTS:
+            return DEFAULT_PIPE_PARAMS
+        _pipe_params = tune_pipe(texts)
+    return _pipe_params
+
+
+def anonymize_text(text, nlp_artifacts=None, lazy_spacy=LAZY_SPACY):
+    """Анонимизирует один текст, возвращает (текст с метками, маппинг)"""
+    manager = AnonymizationManager()
+
+    if lazy_spacy:
+        analyzer, entities = get_regex_analyzer(), REGEX_ENTITIES
+    else:
+        analyzer, entities = get_analyzer(), ENTITIES
+
+    results = analyzer.analyze(
+        text=text,
+        language='ru',
+        entities=entities,
+        nlp_artifacts=nlp_artifacts
+    )
+
+    # Сортировка для корректной работы анонимизатора
+    results.sort(key=attrgetter("start"))
+
+    # Один оператор на все типы сущностей, тип Presidio передает сам
+    operators = {"DEFAULT": OperatorConfig("placeholder", {"manager": manager})}
+
+    anonymized_result = get_anonymizer().anonymize(
+        text=text,
+        analyzer_results=results,
+        operators=operators
+    )
+    return anonymized_result.text, manager.mapping
+
+
+def anonymize_batch(texts, lazy_spacy=LAZY_SPACY):
+    """Анонимизирует список текстов, прогоняя их через spaCy одним nlp.pipe()"""
+    if lazy_spacy:
+        return [anonymize_text(text, lazy_spacy=True) for text in texts]
 
-print("--- АНОНИМИЗИРОВАННЫЙ ТЕКСТ ---")
-print(anonymized_result.text)
-print(f"Время обработки: {time_end - time_start:.4f} сек")
+    nlp_engine = get_nlp_engine()
+    batch_size, n_process = get_pipe_params(texts)
+    processed = nlp_engine.process_batch(
+        texts, language='ru', batch_size=batch_size, n_process=n_process
+    )
+    return [anonymize_text(text, nlp_artifacts) for text, nlp_artifacts in processed]
 
-print("\n--- КАРТА ДАННЫХ ---")
-for k, v in manager.mapping.items():
-    print(f"{k}: {v}")
 
+if __name__ == "__main__":
+    time_start = time.time()
+    anonymized_text, mapping = anonymize_text(example_4)
+    time_end = time.time()
 
-def restore(text, mapping):
-    # Сортируем ключи по длине (от длинных к коротким), чтобы избежать частичной замены
-    for placeholder in sorted(mapping.keys(), key=len, reverse=True):
-        text = text.replace(placeholder, mapping[placeholder])
-    return text
+    print("--- АНОНИМИЗИРОВАННЫЙ ТЕКСТ ---")
+    print(anonymized_text)
+    print(f"Время обработки: {time_end - time_start:.4f} сек")
 
+    print("\n--- КАРТА ДАННЫХ ---")
+    for k, v in mapping.items():
+        print(f"{k}: {v}")
 
-print("\n--- ВОССТАНОВЛЕННЫЙ ТЕКСТ ---")
-print(restore(anonymized_result.text, manager.mapping))
\ No newline at end of file
+    print("\n--- ВОССТАНОВЛЕННЫЙ ТЕКСТ ---")
+    print(restore(anonymized_text, mapping))
@@ -0,0 +1,32 @@
+"""
+Общие фикстуры тестов
+"""
+import os
+
+import httpx
+import pytest
+
+
+# Адрес развернутого API, например http://localhost:8000/anonymize. Если не задан,
+# приложение из main.py поднимается прямо в процессе тестов, без сети
+API_URL = os.getenv("ANONYMIZER_API_URL")
+
+
+@pytest.fixture(scope="session")
+def client():
+    """Клиент API: живой сервер по API_URL или ASGI-приложение в процессе"""
+    if API_URL:
+        with httpx.Client(base_url=API_URL.rsplit("/", 1)[0], timeout=30) as http_client:
+            yield http_client
+        return
+    
+    from fastapi.testclient import TestClient
+    import main
+    
+    # Модель грузится в фоне при импорте main. Дожидаемся ее один раз на всю
+    # сессию, чтобы загрузка не попадала в processing_time первого теста
+    main.ner_model_loaded.result()
+    
+    # Через with, чтобы отработали startup/shutdown (батчер NER)
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -1,12 +1,22 @@
 """
 Сервис анонимизации персональных данных с использованием DeepPavlov NER
 """
+import asyncio
+import concurrent.futures
+import os
 import time
 import re
-from typing import Dict, List
+import threading
+import traceback
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Tuple
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
+from ner_batching import NerBatcher
+from placeholders import restore_text
+
 # Импорт DeepPavlov
 try:
     from deeppavlov import build_model, configs
@@ -15,12 +25,26 @@ except ImportError:
     print("DeepPavlov не установлен. Установите: pip install deeppavlov")
     DEEPPAVLOV_AVAILABLE = False
 
+# Hyperscan (опционально) - DFA-сканер для цифровых паттернов
+try:
+    import hyperscan
+    HYPERSCAN_AVAILABLE = True
+except ImportError:
+    print("Hyperscan не установлен, используется re. Установите: pip install hyperscan")
+    HYPERSCAN_AVAILABLE = False
+
 app = FastAPI(title="Anonymization Service (DeepPavlov)")
 
 # --- Инициализация DeepPavlov NER модели ---
 
 ner_model = None
-if DEEPPAVLOV_AVAILABLE:
+# Модель грузится в фоновом потоке, чтобы не задерживать старт uvicorn.
+# Запросы, пришедшие раньше, ждут этот future, а не идут без NER
+ner_model_loaded = concurrent.futures.Future()
+
+
+def _load_ner_model():
+    global ner_model
     try:
         print("Загрузка DeepPavlov NER модели...")
         # Используем модель ner_rus_bert для русского языка
@@ -29,93 +53,203 @@ if DEEPPAVLOV_AVAILABLE:
     except Exception as e:
         print(f"Ошибка загрузки DeepPavlov модели: {e}")
         ner_model = None
+    finally:
+        ner_model_loaded.set_result(None)
+
+
+if DEEPPAVLOV_AVAILABLE:
+    threading.Thread(target=_load_ner_model, name="ner-model-loader", daemon=True).start()
+else:
+    ner_model_loaded.set_result(None)
+
+# Кеш распознанных сущностей по тексту: повторно присланный текст (ретраи,
+# идемпотентные клиенты) не гоняется через NER заново. Ключи кеша - исходные
+# тексты с ПДн, они живут в памяти процесса, поэтому по умолчанию кеш выключен (0)
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "0"))
+
+# Имена и локации почти всегда пишутся с заглавной: при NER_SKIP_LOWERCASE=1
+# предложения без заглавных букв в модель не идут и разбираются только паттернами.
+# По умолчанию выключено - модель находит и имена, набранные строчными
+NER_SKIP_LOWERCASE = os.getenv("NER_SKIP_LOWERCASE", "0") == "1"
 
 
 # --- Паттерны для распознавания персональных данных ---
 
+class PatternInfo:
+    """Информация о паттерне"""
+    def __init__(self, regex: str, score: float, prefilter: str = None):
+        self.regex = regex
+        # Компилируем один раз, чтобы не зависеть от маленького кеша re
+        self.compiled = re.compile(regex)
+        self.score = score
+        # Дешевая проверка того, без чего паттерн точно не совпадет
+        # (ключевое слово или цифра). Если ее нет в тексте, паттерн не запускаем
+        self.prefilter = re.compile(prefilter) if prefilter else None
+
+
+# Паттерны собираются один раз при импорте модуля
+PATTERNS = {
+    "PHONE_NUMBER": [
+        PatternInfo(
+            regex=r'(\+7|8|7)[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}',
+            score=0.9,
+            prefilter=r'\d{3}\D?\d{2}\D?\d{2}'
+        )
+    ],
+    "INN": [
+        # 10 и 12 цифр одной альтернацией: серия цифр между \b бывает только
+        # одной длины, поэтому совпадения те же, что у двух отдельных паттернов
+        PatternInfo(
+            regex=r'\b\d{10}\b|\b\d{12}\b',
+            score=0.9,
+            prefilter=r'\d{10}'
+        ),
+    ],
+    "PASSPORT": [
+        PatternInfo(
+            regex=r'(?:паспорт\s*)?(?:серия\s*)?(?:\d{2}\s?\d{2}|\d{4})[\s\-]?(?:номер\s*)?\d{6}',
+            score=0.95,
+            prefilter=r'\d{6}'
+        ),
+    ],
+    "ADDRESS": [
+        # Проспект с сокращением "пр" - МАКСИМАЛЬНЫЙ ПРИОРИТЕТ
+        PatternInfo(
+            regex=r"(?i)(?:северный|южный|восточный|западный|центральный|красный|зеленый|синий|новый|старый)\s+пр\s+\d+",
+            score=0.95,
+            prefilter=r"(?i)пр\s+\d"
+        ),
+        # Линия с домом через точку. (?<!\d) не дает начинать поиск внутри
+        # серии цифр: иначе на длинном числе каждая позиция дочитывает его до конца
+        PatternInfo(
+            regex=r"(?i)(?<!\d)\d+(?:-я|-й|-е|-ая|-ый|-ое)?\s+линия\s+д\.\d+[А-ЯЁа-яё]?",
+            score=0.95,
+            prefilter=r"(?i)линия\s+д\."
+        ),
+        # Проспект с прилагательным
+        PatternInfo(
+            regex=r"(?i)[А-ЯЁа-яё]+(?:ый|ий|ой|ая|ое)\s+пр\s+\d+",
+            score=0.9,
+            prefilter=r"(?i)пр\s+\d"
+        ),
+        # Линия с номером дома
+        PatternInfo(
+            regex=r"(?i)(?<!\d)\d+(?:-я|-й|-е|-ая|-ый|-ое)?\s+линия(?:\s+[А-ЯЁа-яё\.]+)?(?:\s*[,]?\s*)?(?:д\.?\s*\d+[А-ЯЁа-яё]?|дом\s*\d+[А-ЯЁа-яё]?)?",
+            score=0.9,
+            prefilter=r"(?i)линия"
+        ),
+        # Полный адрес
+        PatternInfo(
+            regex=r"(?i)(?:г|город|г\.)\s+[А-ЯЁа-яё\-]+(?:\s*,\s*)?(?:(?:ул|улица|ул\.|пр-т|проспект|пр\.|наб|набережная|наб\.|пер|переулок|пер\.|ш|шоссе|ш\.|б-р|бульвар|б-р\.)\s+[А-ЯЁа-яё0-9\-\.]+)?(?:\s*,\s*)?(?:(?:д|дом|д\.|стр|строение|стр\.|корп|корпус|корп\.|к|к\.)\s*[А-ЯЁа-яё0-9\-]+)?(?:\s*,\s*)?(?:(?:кв|квартира|кв\.|оф|офис|оф\.)\s*[А-ЯЁа-яё0-9\-]+)?",
+            score=0.85,
+            prefilter=r"(?i)(?:г\.?|город)\s"
+        ),
+        # Улица с номером дома
+        PatternInfo(
+            regex=r"(?i)\b[А-ЯЁа-яё][А-ЯЁа-яё\-]+(?:ская|скаяя|ской|ая|ий|ый|ой|ое|ов|а|ы|и|е)\s+(?:д\.?\s*)?\d+[А-ЯЁа-яё]?\b",
+            score=0.8,
+            prefilter=r"\d"
+        ),
+        # Шоссе с домом
+        PatternInfo(
+            regex=r"(?i)\b[А-ЯЁа-яё]+(?:ое|ая|ий|ый|ой)\s+(?:ш|шоссе|ш\.)(?:\s*,\s*)?(?:(?:д|дом|д\.)\s*[А-ЯЁа-яё0-9\-]+)?",
+            score=0.8,
+            prefilter=r"(?i)\sш"
+        ),
+        # Квартира с подъездом
+        PatternInfo(
+            regex=r"(?i)(?:кв|квартира|кв\.)\s*[А-ЯЁа-яё0-9\-]+(?:\s*,\s*)?(?:(?:\d+\s+)?(?:парадная|подъезд|подъезд\s*\d+))?(?:\s*,\s*)?(?:(?:этаж|эт\.)\s*\d+)?",
+            score=0.7,
+            prefilter=r"(?i)кв"
+        ),
+        # Метро и адрес. Слова берутся целиком через (?=(...))\1 - аналог атомарной
+        # группы для Python 3.10, а последнее слово перед номером, которое раньше
+        # откусывалось от предыдущего, заменено проверкой (?<=...{2}). Совпадения
+        # те же, но без перебора всех разбиений слова при неудаче
+        PatternInfo(
+            regex=r"(?i)метро\s+(?=([А-ЯЁа-яё\-]+))\1(?:\s+(?=([А-ЯЁа-яё\-]+))\2)*(?:(?:\s*,\s*)?(?:\d+\s+минут\s+от\s+метро)?(?:\s*,\s*)?[А-ЯЁа-яё\-]+|(?<=[А-ЯЁа-яё\-]{2}))\s+\d+",
+            score=0.7,
+            prefilter=r"(?i)метро"
+        ),
+    ]
+}
+
+
+# Регулярки постобработки компилируются один раз при импорте
+_SENT_SPLIT = re.compile(r'[.!?]\s+')
+_LOC_NUM_AFTER = re.compile(r'\s+(?:д\.?\s*)?(\d+[А-ЯЁа-яё]?)')
+_LOC_NUM_BEFORE = re.compile(r'(\d+(?:-я|-й|-е|-ая|-ый|-ое)?)\s+')
+_WS = re.compile(r'\s+')
+_DIGIT = re.compile(r'\d')
+_LETTER = re.compile(r'[^\W\d_]')
+_UPPER = re.compile(r'[А-ЯЁA-Z]')
+# Признак предложения, которое стоит отправлять в NER
+_NER_CANDIDATE = _UPPER if NER_SKIP_LOWERCASE else _LETTER
+
+
+# Сущности, чьи prefilter проверяет Hyperscan - все разом за один проход.
+# Сами совпадения ищет re: \b и \d в Hyperscan устроены иначе, и на тексте
+# с кириллицей или не-ASCII цифрами его границы расходились бы с re.
+# Адреса проверяются как обычно, их prefilter регистронезависимы по кириллице
+HYPERSCAN_ENTITIES = ("PHONE_NUMBER", "INN", "PASSPORT")
+
+
 class PatternRecognizer:
     """Класс для распознавания сущностей по паттернам"""
     
     def __init__(self):
-        self.patterns = {
-            "PHONE_NUMBER": [
-                PatternInfo(
-                    regex=r'(\+7|8|7)[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}',
-                    score=0.9
-                )
-            ],
-            "INN": [
-                PatternInfo(
-                    regex=r'\b\d{10}\b',
-                    score=0.9
-                ),
-                PatternInfo(
-                    regex=r'\b\d{12}\b',
-                    score=0.9
-                ),
-            ],
-            "PASSPORT": [
-                PatternInfo(
-                    regex=r'(?:паспорт\s*)?(?:серия\s*)?(?:\d{2}\s?\d{2}|\d{4})[\s\-]?(?:номер\s*)?\d{6}',
-                    score=0.95
-                ),
-            ],
-            "ADDRESS": [
-                # Проспект с сокращением "пр" - МАКСИМАЛЬНЫЙ ПРИОРИТЕТ
-                PatternInfo(
-                    regex=r"(?i)(?:северный|южный|восточный|западный|центральный|красный|зеленый|синий|новый|старый)\s+пр\s+\d+",
-                    score=0.95
-                ),
-                # Линия с домом через точку
-                PatternInfo(
-                    regex=r"(?i)\d+(?:-я|-й|-е|-ая|-ый|-ое)?\s+линия\s+д\.\d+[А-ЯЁа-яё]?",
-                    score=0.95
-                ),
-                # Проспект с прилагательным
-                PatternInfo(
-                    regex=r"(?i)[А-ЯЁа-яё]+(?:ый|ий|ой|ая|ое)\s+пр\s+\d+",
-                    score=0.9
-                ),
-                # Линия с номером дома
-                PatternInfo(
-                    regex=r"(?i)\d+(?:-я|-й|-е|-ая|-ый|-ое)?\s+линия(?:\s+[А-ЯЁа-яё\.]+)?(?:\s*[,]?\s*)?(?:д\.?\s*\d+[А-ЯЁа-яё]?|дом\s*\d+[А-ЯЁа-яё]?)?",
-                    score=0.9
-                ),
-                # Полный адрес
-                PatternInfo(
-                    regex=r"(?i)(?:г|город|г\.)\s+[А-ЯЁа-яё\-]+(?:\s*,\s*)?(?:(?:ул|улица|ул\.|пр-т|проспект|пр\.|наб|набережная|наб\.|пер|переулок|пер\.|ш|шоссе|ш\.|б-р|бульвар|б-р\.)\s+[А-ЯЁа-яё0-9\-\.]+)?(?:\s*,\s*)?(?:(?:д|дом|д\.|стр|строение|стр\.|корп|корпус|корп\.|к|к\.)\s*[А-ЯЁа-яё0-9\-]+)?(?:\s*,\s*)?(?:(?:кв|квартира|кв\.|оф|офис|оф\.)\s*[А-ЯЁа-яё0-9\-]+)?",
-                    score=0.85
-                ),
-                # Улица с номером дома
-                PatternInfo(
-                    regex=r"(?i)\b[А-ЯЁа-яё][А-ЯЁа-яё\-]+(?:ская|скаяя|ской|ая|ий|ый|ой|ое|ов|а|ы|и|е)\s+(?:д\.?\s*)?\d+[А-ЯЁа-яё]?\b",
-                    score=0.8
-                ),
-                # Шоссе с домом
-                PatternInfo(
-                    regex=r"(?i)\b[А-ЯЁа-яё]+(?:ое|ая|ий|ый|ой)\s+(?:ш|шоссе|ш\.)(?:\s*,\s*)?(?:(?:д|дом|д\.)\s*[А-ЯЁа-яё0-9\-]+)?",
-                    score=0.8
-                ),
-                # Квартира с подъездом
-                PatternInfo(
-                    regex=r"(?i)(?:кв|квартира|кв\.)\s*[А-ЯЁа-яё0-9\-]+(?:\s*,\s*)?(?:(?:\d+\s+)?(?:парадная|подъезд|подъезд\s*\d+))?(?:\s*,\s*)?(?:(?:этаж|эт\.)\s*\d+)?",
-                    score=0.7
-                ),
-                # Метро и адрес
-                PatternInfo(
-                    regex=r"(?i)метро\s+[А-ЯЁа-яё\-]+(?:\s+[А-ЯЁа-яё\-]+)*(?:\s*,\s*)?(?:\d+\s+минут\s+от\s+метро)?(?:\s*,\s*)?[А-ЯЁа-яё\-]+\s+\d+",
-                    score=0.7
-                ),
-            ]
-        }
+        self.patterns = PATTERNS
+        self.hs_database = None
+        self.hs_patterns = []
+        # Scratch у Hyperscan нельзя делить между потоками, держим по одному на поток
+        self._hs_local = threading.local()
+        if HYPERSCAN_AVAILABLE:
+            self._compile_hyperscan()
+    
+    def _compile_hyperscan(self):
+        """Собирает prefilter цифровых паттернов в одну базу Hyperscan"""
+        self.hs_patterns = [
+            pattern_info
+            for entity_type in HYPERSCAN_ENTITIES
+            for pattern_info in self.patterns[entity_type]
+        ]
+        ids = list(range(len(self.hs_patterns)))
+        self.hs_database = hyperscan.Database()
+        # UCP - чтобы \d, как и в re, включал не только ASCII-цифры.
+        # SINGLEMATCH - для prefilter хватает первого срабатывания
+        self.hs_database.compile(
+            expressions=[pattern_info.prefilter.pattern.encode("utf-8") for pattern_info in self.hs_patterns],
+            ids=ids,
+            elements=len(ids),
+            flags=[hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_SINGLEMATCH] * len(ids),
+        )
+    
+    def _hyperscan_candidates(self, text: str) -> set:
+        """Один проход Hyperscan по тексту: паттерны, чей prefilter нашелся"""
+        found = set()
+        
+        def on_match(pattern_id, start, end, flags, context):
+            found.add(self.hs_patterns[pattern_id])
+        
+        scratch = getattr(self._hs_local, "scratch", None)
+        if scratch is None:
+            scratch = self._hs_local.scratch = hyperscan.Scratch(self.hs_database)
+        self.hs_database.scan(text.encode("utf-8"), match_event_handler=on_match, scratch=scratch)
+        return found
     
     def recognize(self, text: str) -> List[Dict]:
         """Распознает сущности по паттернам"""
         results = []
+        hs_candidates = self._hyperscan_candidates(text) if self.hs_database else None
         
         for entity_type, patterns in self.patterns.items():
             for pattern_info in patterns:
-                for match in re.finditer(pattern_info.regex, text):
+                if hs_candidates is not None and entity_type in HYPERSCAN_ENTITIES:
+                    if pattern_info not in hs_candidates:
+                        continue
+                elif pattern_info.prefilter and not pattern_info.prefilter.search(text):
+                    continue
+                for match in pattern_info.compiled.finditer(text):
                     results.append({
                         "entity": entity_type,
                         "start": match.start(),
@@ -127,28 +261,25 @@ class PatternRecognizer:
         return results
 
 
-class PatternInfo:
-    """Информация о паттерне"""
-    def __init__(self, regex: str, score: float):
-        self.regex = regex
-        self.score = score
-
-
 pattern_recognizer = PatternRecognizer()
 
 
 # --- Функции постобработки ---
 
+# Слова, на которых заканчивается захваченное имя
+_STOP_WORDS = frozenset([
+    'время', 'место', 'номер', 'телефон', 'адрес', 'дата',
+    'день', 'месяц', 'год', 'лет', 'часов', 'минут',
+    'квартира', 'подъезд', 'этаж', 'дом', 'улица', 'сообщу'
+])
+
+
 def clean_name_text(text: str) -> str:
     """Очищает захваченный текст имени от лишних данных"""
     if not text:
         return text
     
-    text = re.sub(r'\s+', ' ', text.strip())
-    
-    stop_words = ['время', 'место', 'номер', 'телефон', 'адрес', 'дата', 
-                  'день', 'месяц', 'год', 'лет', 'часов', 'минут',
-                  'квартира', 'подъезд', 'этаж', 'дом', 'улица', 'сообщу']
+    text = _WS.sub(' ', text.strip())
     
     words = text.split()
     cleaned_words = []
@@ -159,15 +290,12 @@ def clean_name_text(text: str) -> str:
         if not word_clean:
             continue
         
-        if word_clean.lower() in stop_words:
+        if word_clean.lower() in _STOP_WORDS:
             break
         
         if word_clean[0].isupper() and (word_clean.replace('-', '').isalpha() or 
                                        (len(word_clean) <= 3 and word_clean.isdigit())):
             cleaned_words.append(word_clean)
-        elif not cleaned_words:
-            if word_clean[0].isupper() and word_clean.replace('-', '').isalpha():
-                cleaned_words.append(word_clean)
     
     if cleaned_words:
         result = ' '.join(cleaned_words)
@@ -189,7 +317,7 @@ def clean_address_text(text: str) -> str:
     if not text:
         return text
     
-    text = re.sub(r'\s+', ' ', text.strip())
+    text = _WS.sub(' ', text.strip())
     text = text.rstrip('.,!?;:')
     
     if len(text) > 200:
@@ -206,43 +334,60 @@ def clean_address_text(text: str) -> str:
 
 # --- Логика управления метками ---
 
+_LABEL_MAP = {
+    "PER": "ИМЯ",
+    "PERSON": "ИМЯ",
+    "ORG": "ОРГАНИЗАЦИЯ",
+    "LOC": "АДРЕС",
+    "PHONE_NUMBER": "ТЕЛЕФОН",
+    "INN": "ИНН",
+    "PASSPORT": "ПАСПОРТ",
+    "ADDRESS": "АДРЕС",
+    "LOCATION": "АДРЕС"
+}
+
+
+_NAME_TYPES = frozenset(("PERSON", "PER"))
+_ADDRESS_TYPES = frozenset(("ADDRESS", "LOCATION", "LOC"))
+
+
 class RequestAnonymizer:
     """Класс для обработки одного конкретного запроса"""
 
+    # Экземпляр создается на каждый запрос, __slots__ убирает у него __dict__
+    __slots__ = ("counters", "mapping", "_seen")
+
+    # Общий для всех запросов, не пересоздается в __init__
+    label_map = _LABEL_MAP
+
     def __init__(self):
-        self.counters = {}
+        self.counters = defaultdict(int)
         self.mapping = {}
-        self.label_map = {
-            "PER": "ИМЯ",
-            "PERSON": "ИМЯ",
-            "ORG": "ОРГАНИЗАЦИЯ",
-            "LOC": "АДРЕС",
-            "PHONE_NUMBER": "ТЕЛЕФОН",
-            "INN": "ИНН",
-            "PASSPORT": "ПАСПОРТ",
-            "ADDRESS": "АДРЕС",
-            "LOCATION": "АДРЕС"
-        }
+        # Обратный индекс (метка, исходный текст) -> метка-замена,
+        # чтобы повторы одной и той же сущности получали одну метку
+        self._seen = {}
 
     def get_replacement(self, original_text: str, entity_type: str) -> str:
         """Получает метку-замену для сущности"""
         ru_label = self.label_map.get(entity_type, entity_type)
         
-        if ru_label not in self.counters:
-            self.counters[ru_label] = 1
+        key = (ru_label, original_text)
+        placeholder = self._seen.get(key)
+        if placeholder is not None:
+            return placeholder
         
+        # Счетчик только растет, поэтому каждая метка новая и в mapping ее еще нет
+        self.counters[ru_label] += 1
         placeholder = f"{{{ru_label}_{self.counters[ru_label]}}}"
         
-        if placeholder not in self.mapping:
-            if entity_type in ["PERSON", "PER"]:
-                cleaned_text = clean_name_text(original_text)
-                self.mapping[placeholder] = cleaned_text if cleaned_text else original_text
-            elif entity_type in ["ADDRESS", "LOCATION", "LOC"]:
-                cleaned_text = clean_address_text(original_text)
-                self.mapping[placeholder] = cleaned_text if cleaned_text else original_text
-            else:
-                self.mapping[placeholder] = original_text
-            self.counters[ru_label] += 1
+        if entity_type in _NAME_TYPES:
+            cleaned_text = clean_name_text(original_text)
+        elif entity_type in _ADDRESS_TYPES:
+            cleaned_text = clean_address_text(original_text)
+        else:
+            cleaned_text = None
+        self.mapping[placeholder] = cleaned_text if cleaned_text else original_text
+        self._seen[key] = placeholder
         
         return placeholder
 
@@ -259,6 +404,15 @@ class AnonymizeResponse(BaseModel):
     processing_time: float
 
 
+class BulkAnonymizeRequest(BaseModel):
+    texts: List[str]
+
+
+class BulkAnonymizeResponse(BaseModel):
+    results: List[AnonymizeResponse]
+    processing_time: float
+
+
 class DeanonymizeRequest(BaseModel):
     text: str
     mapping: Dict[str, str]
@@ -270,236 +424,228 @@ class DeanonymizeResponse(BaseModel):
 
 # --- Основная функция распознавания ---
 
-def recognize_entities_with_deeppavlov(text: str) -> List[Dict]:
-    """Распознает сущности используя DeepPavlov NER модель"""
+def _split_sentences(text: str) -> List[Tuple[int, str]]:
+    """Разбивает текст на предложения, возвращает пары (начало в тексте, предложение)"""
+    sentences = []
+    start_pos = 0
+    # Конец разделителя - начало следующего предложения
+    for match in _SENT_SPLIT.finditer(text):
+        sentence = text[start_pos:match.end()].strip()
+        if sentence:
+            sentences.append((start_pos, sentence))
+        start_pos = match.end()
+    
+    sentence = text[start_pos:].strip()
+    if sentence:
+        sentences.append((start_pos, sentence))
+    
+    return sentences
+
+
+def _parse_ner_output(model_result, count: int) -> List[Tuple[List[str], List[str]]]:
+    """Приводит ответ ner_model на батч к списку (tokens, tags) по предложениям"""
+    pairs = []
+    if isinstance(model_result, (list, tuple)) and len(model_result) > 0:
+        first = model_result[0]
+        if isinstance(first, tuple) and len(first) == 2:
+            # [(tokens, tags), ...]
+            pairs = [tuple(item) for item in model_result]
+        elif isinstance(first, list) and (not first or isinstance(first[0], list)):
+            # [tokens_batch, tags_batch] - штатный формат DeepPavlov
+            tags_batch = model_result[1] if len(model_result) > 1 else []
+            pairs = list(zip(first, tags_batch))
+        elif isinstance(first, list):
+            # [tokens, tags] для одного предложения
+            pairs = [(first, model_result[1] if len(model_result) > 1 else [])]
+    
+    # На непонятный формат отвечаем пустой разметкой, чтобы ни один запрос не завис
+    pairs = pairs[:count]
+    pairs.extend([([], [])] * (count - len(pairs)))
+    return pairs
+
+
+def _run_ner_model(sentences: List[str]) -> List[Tuple[List[str], List[str]]]:
+    """Размечает батч предложений ner_model"""
+    return _parse_ner_output(ner_model(sentences), len(sentences))
+
+
+ner_batcher = NerBatcher(_run_ner_model)
+
+
+def _emit_entity(results: List[Dict], entity_type: str, entity_tokens: List[str],
+                 start_in_sentence: int, sentence: str, start_pos: int):
+    """Добавляет накопленную сущность в results"""
+    entity_text = ' '.join(entity_tokens)
+    entity_start_in_text = start_pos + start_in_sentence
+    entity_end_in_text = entity_start_in_text + len(entity_text)
+    
+    if entity_type != "LOC":
+        results.append({
+            "entity": entity_type,
+            "start": entity_start_in_text,
+            "end": entity_end_in_text,
+            "text": entity_text,
+            "score": 0.85
+        })
+        return
+    
+    # Для LOC (локаций) расширяем контекст для захвата номеров домов
+    expanded_text = entity_text
+    expanded_end = entity_end_in_text
+    
+    # Ищем номер дома после локации (в пределах 30 символов)
+    context_after = sentence[entity_end_in_text - start_pos:entity_end_in_text - start_pos + 30]
+    number_match = _LOC_NUM_AFTER.search(context_after)
+    if number_match:
+        expanded_text = entity_text + number_match.group()
+        expanded_end = entity_end_in_text + len(number_match.group())
+    
+    # Ищем номер перед локацией (если локация не содержит цифр)
+    if not _DIGIT.search(entity_text):
+        context_before = sentence[max(0, entity_start_in_text - start_pos - 20):entity_start_in_text - start_pos]
+        number_match_before = _LOC_NUM_BEFORE.search(context_before)
+        if number_match_before:
+            expanded_text = number_match_before.group(1) + ' ' + expanded_text
+            expanded_start = entity_start_in_text - len(number_match_before.group(1)) - 1
+            entity_start_in_text = max(start_pos, expanded_start)
+    
+    results.append({
+        "entity": "ADDRESS",  # LOC -> ADDRESS
+        "start": entity_start_in_text,
+        "end": expanded_end,
+        "text": expanded_text,
+        "score": 0.9  # Высокий score для адресов из NER
+    })
+
+
+def _decode_sentence(sentence: str, start_pos: int, tokens: List[str], tags: List[str]) -> List[Dict]:
+    """Собирает сущности из BIO тегов одного предложения"""
     results = []
     
-    if ner_model:
-        try:
-            # DeepPavlov ожидает список предложений
-            # Разбиваем текст на предложения для лучшей обработки
-            sentence_endings = re.finditer(r'[.!?]\s+', text)
-            sentence_starts = [0]
-            sentence_ends = []
-            
-            for match in sentence_endings:
-                sentence_ends.append(match.end())
-                sentence_starts.append(match.end())
-            sentence_ends.append(len(text))
+    # Обрабатываем результаты BIO тегов
+    current_entity = None
+    current_tokens = []
+    current_start_in_sentence = 0
+    
+    # Восстанавливаем позиции токенов в предложении
+    sentence_lower = sentence.lower()
+    token_positions = []
+    search_pos = 0
+    
+    sentence_len = len(sentence_lower)
+    for token in tokens:
+        token_lower = token.lower()
+        # Обычно токен начинается сразу после пробелов за предыдущим,
+        # тогда find по остатку предложения не нужен
+        cursor = search_pos
+        while cursor < sentence_len and sentence_lower[cursor].isspace():
+            cursor += 1
+        if token_lower and not token_lower[0].isspace() and sentence_lower.startswith(token_lower, cursor):
+            pos = cursor
+        else:
+            # Ищем токен в предложении
+            pos = sentence_lower.find(token_lower, search_pos)
+        if pos == -1:
+            # Если не нашли точное совпадение, используем приблизительную позицию
+            pos = search_pos
+        token_positions.append((pos, pos + len(token)))
+        search_pos = pos + len(token)
+    
+    # Обрабатываем теги
+    for token, tag, (token_start, token_end) in zip(tokens, tags, token_positions):
+        # Обрабатываем теги BIO
+        if tag and (tag.startswith('B-') or tag.startswith('I-')):
+            entity_type = tag[2:]  # Убираем префикс B- или I-
             
-            # Обрабатываем каждое предложение
-            for i in range(len(sentence_starts)):
-                start_pos = sentence_starts[i]
-                end_pos = sentence_ends[i] if i < len(sentence_ends) else len(text)
-                sentence = text[start_pos:end_pos].strip()
+            if tag.startswith('B-') or current_entity != entity_type:
+                # Сохраняем предыдущую сущность если есть
+                if current_entity and current_tokens:
+                    _emit_entity(results, current_entity, current_tokens,
+                                 current_start_in_sentence, sentence, start_pos)
                 
-                if not sentence:
-                    continue
-                
-                try:
-                    # Применяем модель NER
-                    model_result = ner_model([sentence])
-                    
-                    # Результат может быть в разных форматах
-                    if isinstance(model_result, list) and len(model_result) > 0:
-                        if isinstance(model_result[0], tuple) and len(model_result[0]) == 2:
-                            tokens, tags = model_result[0]
-                        elif isinstance(model_result[0], list):
-                            tokens = model_result[0]
-                            tags = model_result[1] if len(model_result) > 1 else []
-                        else:
-                            continue
-                    else:
-                        continue
-                    
-                    # Обрабатываем результаты BIO тегов
-                    current_entity = None
-                    current_tokens = []
-                    current_start_in_sentence = 0
-                    
-                    # Восстанавливаем позиции токенов в предложении
-                    sentence_lower = sentence.lower()
-                    token_positions = []
-                    search_pos = 0
-                    
-                    for token in tokens:
-                        token_lower = token.lower()
-                        # Ищем токен в предложении
-                        pos = sentence_lower.find(token_lower, search_pos)
-                        if pos == -1:
-                            # Если не нашли точное совпадение, используем приблизительную позицию
-                            pos = search_pos
-                        token_positions.append((pos, pos + len(token)))
-                        search_pos = pos + len(token)
-                    
-                    # Обрабатываем теги
-                    for i, (token, tag, (token_start, token_end)) in enumerate(zip(tokens, tags, token_positions)):
-                        # Обрабатываем теги BIO
-                        if tag and (tag.startswith('B-') or tag.startswith('I-')):
-                            entity_type = tag[2:]  # Убираем префикс B- или I-
-                            
-                            if tag.startswith('B-') or current_entity != entity_type:
-                                # Сохраняем предыдущую сущность если есть
-                                if current_entity and current_tokens:
-                                    entity_text = ' '.join(current_tokens)
-                                    entity_start_in_text = start_pos + current_start_in_sentence
-                                    entity_end_in_text = entity_start_in_text + len(entity_text)
-                                    
-                                    # Для LOC (локаций) расширяем контекст для захвата номеров домов
-                                    if current_entity == "LOC":
-                                        expanded_text = entity_text
-                                        expanded_end = entity_end_in_text
-                                        
-                                        # Ищем номер дома после локации
-                                        context_after = sentence[entity_end_in_text - start_pos:entity_end_in_text - start_pos + 30]
-                                        number_match = re.search(r'\s+(?:д\.?\s*)?(\d+[А-ЯЁа-яё]?)', context_after)
-                                        if number_match:
-                                            expanded_text = entity_text + number_match.group()
-                                            expanded_end = entity_end_in_text + len(number_match.group())
-                                        
-                                        # Ищем номер перед локацией
-                                        if not any(char.isdigit() for char in entity_text):
-                                            context_before = sentence[max(0, entity_start_in_text - start_pos - 20):entity_start_in_text - start_pos]
-                                            number_match_before = re.search(r'(\d+(?:-я|-й|-е|-ая|-ый|-ое)?)\s+', context_before)
-                                            if number_match_before:
-                                                expanded_text = number_match_before.group(1) + ' ' + expanded_text
-                                                expanded_start = entity_start_in_text - len(number_match_before.group(1)) - 1
-                                                entity_start_in_text = max(start_pos, expanded_start)
-                                        
-                                        results.append({
-                                            "entity": "ADDRESS",  # LOC -> ADDRESS
-                                            "start": entity_start_in_text,
-                                            "end": expanded_end,
-                                            "text": expanded_text,
-                                            "score": 0.9
-                                        })
-                                    else:
-                                        results.append({
-                                            "entity": current_entity,
-                                            "start": entity_start_in_text,
-                                            "end": entity_end_in_text,
-                                            "text": entity_text,
-                                            "score": 0.85
-                                        })
-                                
-                                # Начинаем новую сущность
-                                current_entity = entity_type
-                                current_tokens = [token]
-                                current_start_in_sentence = token_start
-                            else:
-                                # Продолжаем текущую сущность
-                                current_tokens.append(token)
-                        else:
-                            # Сохраняем предыдущую сущность если есть
-                            if current_entity and current_tokens:
-                                entity_text = ' '.join(current_tokens)
-                                entity_start_in_text = start_pos + current_start_in_sentence
-                                entity_end_in_text = entity_start_in_text + len(entity_text)
-                                
-                                # Для LOC (локаций) расширяем контекст для захвата номеров домов
-                                if current_entity == "LOC":
-                                    expanded_text = entity_text
-                                    expanded_end = entity_end_in_text
-                                    
-                                    # Ищем номер дома после локации
-                                    context_after = sentence[entity_end_in_text - start_pos:entity_end_in_text - start_pos + 30]
-                                    number_match = re.search(r'\s+(?:д\.?\s*)?(\d+[А-ЯЁа-яё]?)', context_after)
-                                    if number_match:
-                                        expanded_text = entity_text + number_match.group()
-                                        expanded_end = entity_end_in_text + len(number_match.group())
-                                    
-                                    # Ищем номер перед локацией
-                                    if not any(char.isdigit() for char in entity_text):
-                                        context_before = sentence[max(0, entity_start_in_text - start_pos - 20):entity_start_in_text - start_pos]
-                                        number_match_before = re.search(r'(\d+(?:-я|-й|-е|-ая|-ый|-ое)?)\s+', context_before)
-                                        if number_match_before:
-                                            expanded_text = number_match_before.group(1) + ' ' + expanded_text
-                                            expanded_start = entity_start_in_text - len(number_match_before.group(1)) - 1
-                                            entity_start_in_text = max(start_pos, expanded_start)
-                                    
-                                    results.append({
-                                        "entity": "ADDRESS",  # LOC -> ADDRESS
-                                        "start": entity_start_in_text,
-                                        "end": expanded_end,
-                                        "text": expanded_text,
-                                        "score": 0.9
-                                    })
-                                else:
-                                    results.append({
-                                        "entity": current_entity,
-                                        "start": entity_start_in_text,
-                                        "end": entity_end_in_text,
-                                        "text": entity_text,
-                                        "score": 0.85
-                                    })
-                            
-                            current_entity = None
-                            current_tokens = []
-                    
-                    # Сохраняем последнюю сущность если есть
-                    if current_entity and current_tokens:
-                        entity_text = ' '.join(current_tokens)
-                        entity_start_in_text = start_pos + current_start_in_sentence
-                        entity_end_in_text = entity_start_in_text + len(entity_text)
-                        
-                        # Для LOC (локаций) расширяем контекст для захвата номеров домов
-                        if current_entity == "LOC":
-                            # Ищем номера домов рядом с локацией
-                            expanded_text = entity_text
-                            expanded_end = entity_end_in_text
-                            
-                            # Ищем номер дома после локации (в пределах 30 символов)
-                            context_after = sentence[entity_end_in_text - start_pos:entity_end_in_text - start_pos + 30]
-                            number_match = re.search(r'\s+(?:д\.?\s*)?(\d+[А-ЯЁа-яё]?)', context_after)
-                            if number_match:
-                                expanded_text = entity_text + number_match.group()
-                                expanded_end = entity_end_in_text + len(number_match.group())
-                            
-                            # Ищем номер перед локацией (если локация не содержит цифр)
-                            if not any(char.isdigit() for char in entity_text):
-                                context_before = sentence[max(0, entity_start_in_text - start_pos - 20):entity_start_in_text - start_pos]
-                                number_match_before = re.search(r'(\d+(?:-я|-й|-е|-ая|-ый|-ое)?)\s+', context_before)
-                                if number_match_before:
-                                    expanded_text = number_match_before.group(1) + ' ' + expanded_text
-                                    expanded_start = entity_start_in_text - len(number_match_before.group(1)) - 1
-                                    entity_start_in_text = max(start_pos, expanded_start)
-                            
-                            results.append({
-                                "entity": "ADDRESS",  # LOC -> ADDRESS
-                                "start": entity_start_in_text,
-                                "end": expanded_end,
-                                "text": expanded_text,
-                                "score": 0.9  # Высокий score для адресов из NER
-                            })
-                        else:
-                            results.append({
-                                "entity": current_entity,
-                                "start": entity_start_in_text,
-                                "end": entity_end_in_text,
-                                "text": entity_text,
-                                "score": 0.85
-                            })
-                
-                except Exception as e:
-                    print(f"Ошибка при обработке предложения '{sentence[:50]}...': {e}")
-                    import traceback
-                    traceback.print_exc()
-                    continue
-        
-        except Exception as e:
-            print(f"Ошибка при использовании DeepPavlov модели: {e}")
-            import traceback
-            traceback.print_exc()
+                # Начинаем новую сущность
+                current_entity = entity_type
+                current_tokens = [token]
+                current_start_in_sentence = token_start
+            else:
+                # Продолжаем текущую сущность
+                current_tokens.append(token)
+        else:
+            # Сохраняем предыдущую сущность если есть
+            if current_entity and current_tokens:
+                _emit_entity(results, current_entity, current_tokens,
+                             current_start_in_sentence, sentence, start_pos)
+            
+            current_entity = None
+            current_tokens = []
+    
+    # Сохраняем последнюю сущность если есть
+    if current_entity and current_tokens:
+        _emit_entity(results, current_entity, current_tokens,
+                     current_start_in_sentence, sentence, start_pos)
     
     return results
 
 
-def recognize_entities(text: str) -> List[Dict]:
+async def recognize_entities_with_deeppavlov(text: str) -> Tuple[List[Dict], bool]:
+    """Распознает сущности используя DeepPavlov NER модель.
+    
+    Вторым значением возвращает, разобраны ли все предложения без ошибок
+    """
+    if not ner_model_loaded.done():
+        await asyncio.wrap_future(ner_model_loaded)
+    if ner_model is None:
+        return [], True
+    
+    results = []
+    complete = True
+    
+    try:
+        # DeepPavlov ожидает список предложений
+        # Разбиваем текст на предложения для лучшей обработки
+        # Имен и локаций без букв не бывает: предложения из одних цифр и знаков
+        # (телефон, ИНН отдельной строкой) в модель не отправляем, а при
+        # NER_SKIP_LOWERCASE - и предложения без заглавных букв
+        sentences = [item for item in _split_sentences(text) if _NER_CANDIDATE.search(item[1])]
+        # Предложения уходят в общий батч вместе с другими запросами
+        outputs = await ner_batcher.submit([sentence for _, sentence in sentences])
+        
+        for (start_pos, sentence), (tokens, tags) in zip(sentences, outputs):
+            try:
+                results.extend(_decode_sentence(sentence, start_pos, tokens, tags))
+            except Exception as e:
+                print(f"Ошибка при обработке предложения '{sentence[:50]}...': {e}")
+                traceback.print_exc()
+                complete = False
+                continue
+    
+    except Exception as e:
+        print(f"Ошибка при использовании DeepPavlov модели: {e}")
+        traceback.print_exc()
+        complete = False
+    
+    return results, complete
+
+
+_entity_cache = OrderedDict()
+
+
+async def recognize_entities(text: str) -> List[Dict]:
     """Распознает все сущности в тексте используя DeepPavlov NER и паттерны"""
+    # Результаты только читаются, поэтому из кеша отдаем тот же список
+    cached = _entity_cache.get(text)
+    if cached is not None:
+        _entity_cache.move_to_end(text)
+        return cached
+    
     all_results = []
     
-    # 1. Используем DeepPavlov NER модель
-    deeppavlov_results = recognize_entities_with_deeppavlov(text)
+    # 1. Используем DeepPavlov NER модель, а паттерны (п. 2) тем временем
+    # считаются в пуле потоков, чтобы регулярки не блокировали event loop
+    (deeppavlov_results, ner_complete), pattern_results = await asyncio.gather(
+        recognize_entities_with_deeppavlov(text),
+        run_in_threadpool(pattern_recognizer.recognize, text)
+    )
     
     # Маппинг типов сущностей из DeepPavlov
     # LOC уже обработан как ADDRESS в recognize_entities_with_deeppavlov
@@ -510,55 +656,72 @@ def recognize_entities(text: str) -> List[Dict]:
             all_results.append(result)
     
     # 2. Используем паттерны для дополнительного распознавания
-    pattern_results = pattern_recognizer.recognize(text)
     all_results.extend(pattern_results)
     
     # 3. Объединяем результаты, удаляя дубликаты
     # Сортируем по позиции начала
     all_results = sorted(all_results, key=lambda x: (x["start"], -x["score"]))
     
-    # Удаляем перекрывающиеся результаты (оставляем с большим score)
+    # Удаляем перекрывающиеся результаты (оставляем с большим score).
+    # Оставленные результаты не пересекаются и идут по возрастанию start,
+    # поэтому новый результат может пересечься только с последним из них
     filtered_results = []
     
     for result in all_results:
-        overlaps = False
-        for existing in filtered_results:
-            if not (result["end"] <= existing["start"] or result["start"] >= existing["end"]):
-                overlaps = True
-                if result["score"] > existing["score"]:
-                    filtered_results.remove(existing)
-                    filtered_results.append(result)
-                break
-        
-        if not overlaps:
+        if filtered_results and result["start"] < filtered_results[-1]["end"]:
+            if result["score"] > filtered_results[-1]["score"]:
+                filtered_results[-1] = result
+        else:
             filtered_results.append(result)
     
-    return sorted(filtered_results, key=lambda x: x["start"])
+    # Если NER упал, здесь только сущности паттернов (без имен) - такой
+    # результат не кешируем, чтобы следующий запрос с тем же текстом прошел NER
+    if ENTITY_CACHE_SIZE > 0 and ner_complete:
+        _entity_cache[text] = filtered_results
+        if len(_entity_cache) > ENTITY_CACHE_SIZE:
+            _entity_cache.popitem(last=False)
+    
+    return filtered_results
 
 
 # --- Эндпоинты ---
 
-@app.post("/anonymize", response_model=AnonymizeResponse)
-async def anonymize_text(req: AnonymizeRequest):
+@app.on_event("startup")
+async def start_ner_batcher():
+    if ner_model:
+        ner_batcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_ner_batcher():
+    await ner_batcher.stop()
+
+
+async def anonymize_one(text: str) -> AnonymizeResponse:
+    """Анонимизирует один текст со своим набором меток"""
     start_time = time.time()
 
     manager = RequestAnonymizer()
 
     # Распознаем сущности
-    entities = recognize_entities(req.text)
-    
-    # Создаем анонимизированный текст
-    anonymized_text = req.text
-    # Заменяем с конца, чтобы не сбить индексы
-    for entity in reversed(entities):
-        entity_type = entity["entity"]
-        original_text = entity["text"]
-        placeholder = manager.get_replacement(original_text, entity_type)
-        
-        start = entity["start"]
-        end = entity["end"]
-        
-        anonymized_text = anonymized_text[:start] + placeholder + anonymized_text[end:]
+    entities = await recognize_entities(text)
+    
+    # Метки выдаем с конца текста, как и раньше, чтобы не поменялась нумерация
+    placeholders = [
+        manager.get_replacement(entity["text"], entity["entity"])
+        for entity in reversed(entities)
+    ]
+    placeholders.reverse()
+    
+    # Собираем анонимизированный текст за один проход слева направо
+    parts = []
+    cursor = 0
+    for entity, placeholder in zip(entities, placeholders):
+        parts.append(text[cursor:entity["start"]])
+        parts.append(placeholder)
+        cursor = entity["end"]
+    parts.append(text[cursor:])
+    anonymized_text = "".join(parts)
 
     return AnonymizeResponse(
         anonymized_text=anonymized_text,
@@ -567,15 +730,27 @@ async def anonymize_text(req: AnonymizeRequest):
     )
 
 
+@app.post("/anonymize", response_model=AnonymizeResponse)
+async def anonymize_text(req: AnonymizeRequest):
+    return await anonymize_one(req.text)
+
+
+@app.post("/bulk_anonymize", response_model=BulkAnonymizeResponse)
+async def bulk_anonymize_text(req: BulkAnonymizeRequest):
+    """Анонимизирует список текстов за один запрос"""
+    start_time = time.time()
+    # Тексты обрабатываются одновременно, поэтому их предложения
+    # попадают в общие батчи NerBatcher, а не идут в модель по одному
+    results = await asyncio.gather(*(anonymize_one(text) for text in req.texts))
+    return BulkAnonymizeResponse(
+        results=results,
+        processing_time=time.time() - start_time
+    )
+
+
 @app.post("/deanonymize", response_model=DeanonymizeResponse)
 async def deanonymize_text(req: DeanonymizeRequest):
-    text = req.text
-    mapping = req.mapping
-    
-    for placeholder in sorted(mapping.keys(), key=len, reverse=True):
-        text = text.replace(placeholder, mapping[placeholder])
-
-    return DeanonymizeResponse(restored_text=text)
+    return DeanonymizeResponse(restored_text=restore_text(req.text, req.mapping))
 
 
 @app.get("/health")
@@ -590,4 +765,7 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Каждый воркер - отдельный процесс со своей копией NER модели,
+    # число воркеров задается через WEB_CONCURRENCY
+    uvicorn.run("main:app", host="0.0.0.0", port=8000,
+                workers=int(os.getenv("WEB_CONCURRENCY", "1")))
@@ -2,14 +2,22 @@
 Улучшенная версия сервиса анонимизации с использованием мощной NER модели
 Использует transformers с русской BERT моделью для лучшего распознавания именованных сущностей
 """
+import asyncio
+import concurrent.futures
+import threading
 import time
 import re
+from collections import defaultdict
 from typing import Dict, List, Optional
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from transformers import pipeline, AutoTokenizer, AutoModelForTokenClassification
 import torch
 
+from ner_batching import NerBatcher
+from placeholders import restore_text
+
 app = FastAPI(title="Advanced Anonymization Service")
 
 # --- Инициализация мощной NER модели ---
@@ -22,32 +30,45 @@ app = FastAPI(title="Advanced Anonymization Service")
 
 MODEL_NAME = "Gherman/bert-base-NER-Russian"  # Можно заменить на более мощную модель
 
-try:
-    # Инициализация NER pipeline
-    print(f"Загрузка модели {MODEL_NAME}...")
-    ner_pipeline = pipeline(
-        "ner",
-        model=MODEL_NAME,
-        tokenizer=MODEL_NAME,
-        aggregation_strategy="simple",
-        device=0 if torch.cuda.is_available() else -1  # Используем GPU если доступно
-    )
-    print("Модель загружена успешно!")
-except Exception as e:
-    print(f"Ошибка загрузки модели {MODEL_NAME}: {e}")
-    print("Попытка загрузки альтернативной модели...")
+ner_pipeline = None
+# Модель грузится в фоновом потоке, чтобы не задерживать старт uvicorn.
+# Запросы, пришедшие раньше, ждут этот future, а не идут без NER
+ner_pipeline_loaded = concurrent.futures.Future()
+
+
+def _load_ner_pipeline():
+    global ner_pipeline, MODEL_NAME
     try:
-        MODEL_NAME = "DeepPavlov/rubert-base-cased-conversational"
+        # Инициализация NER pipeline
+        print(f"Загрузка модели {MODEL_NAME}...")
         ner_pipeline = pipeline(
             "ner",
             model=MODEL_NAME,
+            tokenizer=MODEL_NAME,
             aggregation_strategy="simple",
-            device=0 if torch.cuda.is_available() else -1
+            device=0 if torch.cuda.is_available() else -1  # Используем GPU если доступно
         )
-        print("Альтернативная модель загружена успешно!")
-    except Exception as e2:
-        print(f"Ошибка загрузки альтернативной модели: {e2}")
-        ner_pipeline = None
+        print("Модель загружена успешно!")
+    except Exception as e:
+        print(f"Ошибка загрузки модели {MODEL_NAME}: {e}")
+        print("Попытка загрузки альтернативной модели...")
+        try:
+            MODEL_NAME = "DeepPavlov/rubert-base-cased-conversational"
+            ner_pipeline = pipeline(
+                "ner",
+                model=MODEL_NAME,
+                aggregation_strategy="simple",
+                device=0 if torch.cuda.is_available() else -1
+            )
+            print("Альтернативная модель загружена успешно!")
+        except Exception as e2:
+            print(f"Ошибка загрузки альтернативной модели: {e2}")
+            ner_pipeline = None
+    finally:
+        ner_pipeline_loaded.set_result(None)
+
+
+threading.Thread(target=_load_ner_pipeline, name="ner-model-loader", daemon=True).start()
 
 
 # --- Паттерны для распознавания персональных данных ---
@@ -56,42 +77,55 @@ class PatternRecognizer:
     """Класс для распознавания сущностей по паттернам"""
     
     def __init__(self):
+        # Паттерны парами (регулярка, prefilter). prefilter - дешевая проверка того,
+        # без чего паттерн точно не совпадет (ключевое слово или цифра): если ее
+        # нет в тексте, паттерн не запускаем. None - проверки нет
         self.patterns = {
             "PHONE_NUMBER": [
-                r'(\+7|8|7)[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}',
+                (r'(\+7|8|7)[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}', None),
             ],
             "INN": [
-                r'\b\d{10}\b',
-                r'\b\d{12}\b',
+                (r'\b\d{10}\b', None),
+                (r'\b\d{12}\b', None),
             ],
             "PASSPORT": [
-                r'(?:паспорт\s*)?(?:серия\s*)?(?:\d{2}\s?\d{2}|\d{4})[\s\-]?(?:номер\s*)?\d{6}',
+                (r'(?:паспорт\s*)?(?:серия\s*)?(?:\d{2}\s?\d{2}|\d{4})[\s\-]?(?:номер\s*)?\d{6}', None),
             ],
             "ADDRESS": [
                 # Проспект с сокращением "пр" - МАКСИМАЛЬНЫЙ ПРИОРИТЕТ
-                r'(?i)(?:северный|южный|восточный|западный|центральный|красный|зеленый|синий|новый|старый)\s+пр\s+\d+',
+                (r'(?i)(?:северный|южный|восточный|западный|центральный|красный|зеленый|синий|новый|старый)\s+пр\s+\d+', r'(?i)пр\s+\d'),
                 # Линия с домом через точку
-                r'(?i)\d+(?:-я|-й|-е|-ая|-ый|-ое)?\s+линия\s+д\.\d+[А-ЯЁа-яё]?',
+                (r'(?i)\d+(?:-я|-й|-е|-ая|-ый|-ое)?\s+линия\s+д\.\d+[А-ЯЁа-яё]?', r'(?i)линия\s+д\.'),
                 # Проспект с прилагательным
-                r'(?i)[А-ЯЁа-яё]+(?:ый|ий|ой|ая|ое)\s+пр\s+\d+',
+                (r'(?i)[А-ЯЁа-яё]+(?:ый|ий|ой|ая|ое)\s+пр\s+\d+', r'(?i)пр\s+\d'),
                 # Линия с номером дома
-                r'(?i)\d+(?:-я|-й|-е|-ая|-ый|-ое)?\s+линия(?:\s+[А-ЯЁа-яё\.]+)?(?:\s*[,]?\s*)?(?:д\.?\s*\d+[А-ЯЁа-яё]?|дом\s*\d+[А-ЯЁа-яё]?)?',
+                (r'(?i)\d+(?:-я|-й|-е|-ая|-ый|-ое)?\s+линия(?:\s+[А-ЯЁа-яё\.]+)?(?:\s*[,]?\s*)?(?:д\.?\s*\d+[А-ЯЁа-яё]?|дом\s*\d+[А-ЯЁа-яё]?)?', r'(?i)линия'),
                 # Полный адрес
-                r'(?i)(?:г|город|г\.)\s+[А-ЯЁа-яё\-]+(?:\s*,\s*)?(?:(?:ул|улица|ул\.|пр-т|проспект|пр\.|наб|набережная|наб\.|пер|переулок|пер\.|ш|шоссе|ш\.|б-р|бульвар|б-р\.)\s+[А-ЯЁа-яё0-9\-\.]+)?(?:\s*,\s*)?(?:(?:д|дом|д\.|стр|строение|стр\.|корп|корпус|корп\.|к|к\.)\s*[А-ЯЁа-яё0-9\-]+)?(?:\s*,\s*)?(?:(?:кв|квартира|кв\.|оф|офис|оф\.)\s*[А-ЯЁа-яё0-9\-]+)?',
+                (r'(?i)(?:г|город|г\.)\s+[А-ЯЁа-яё\-]+(?:\s*,\s*)?(?:(?:ул|улица|ул\.|пр-т|проспект|пр\.|наб|набережная|наб\.|пер|переулок|пер\.|ш|шоссе|ш\.|б-р|бульвар|б-р\.)\s+[А-ЯЁа-яё0-9\-\.]+)?(?:\s*,\s*)?(?:(?:д|дом|д\.|стр|строение|стр\.|корп|корпус|корп\.|к|к\.)\s*[А-ЯЁа-яё0-9\-]+)?(?:\s*,\s*)?(?:(?:кв|квартира|кв\.|оф|офис|оф\.)\s*[А-ЯЁа-яё0-9\-]+)?', r'(?i)(?:г\.?|город)\s'),
                 # Улица с номером дома
-                r'(?i)\b[А-ЯЁа-яё][А-ЯЁа-яё\-]+(?:ская|скаяя|ской|ая|ий|ый|ой|ое|ов|а|ы|и|е)\s+(?:д\.?\s*)?\d+[А-ЯЁа-яё]?\b',
+                (r'(?i)\b[А-ЯЁа-яё][А-ЯЁа-яё\-]+(?:ская|скаяя|ской|ая|ий|ый|ой|ое|ов|а|ы|и|е)\s+(?:д\.?\s*)?\d+[А-ЯЁа-яё]?\b', r'\d'),
                 # Шоссе с домом
-                r'(?i)\b[А-ЯЁа-яё]+(?:ое|ая|ий|ый|ой)\s+(?:ш|шоссе|ш\.)(?:\s*,\s*)?(?:(?:д|дом|д\.)\s*[А-ЯЁа-яё0-9\-]+)?',
+                (r'(?i)\b[А-ЯЁа-яё]+(?:ое|ая|ий|ый|ой)\s+(?:ш|шоссе|ш\.)(?:\s*,\s*)?(?:(?:д|дом|д\.)\s*[А-ЯЁа-яё0-9\-]+)?', r'(?i)\sш'),
+            ]
+        }
+        # Компилируем один раз, чтобы не зависеть от маленького кеша re
+        self._compiled = {
+            entity_type: [
+                (re.compile(pattern), re.compile(prefilter) if prefilter else None)
+                for pattern, prefilter in patterns
             ]
+            for entity_type, patterns in self.patterns.items()
         }
     
     def recognize(self, text: str) -> List[Dict]:
         """Распознает сущности по паттернам"""
         results = []
         
-        for entity_type, patterns in self.patterns.items():
-            for pattern in patterns:
-                for match in re.finditer(pattern, text):
+        for entity_type, patterns in self._compiled.items():
+            for pattern, prefilter in patterns:
+                if prefilter and not prefilter.search(text):
+                    continue
+                for match in pattern.finditer(text):
                     results.append({
                         "entity": entity_type,
                         "start": match.start(),
@@ -108,16 +142,22 @@ pattern_recognizer = PatternRecognizer()
 
 # --- Функции постобработки ---
 
+_WS = re.compile(r'\s+')
+
+# Слова, на которых заканчивается захваченное имя
+_STOP_WORDS = frozenset([
+    'время', 'место', 'номер', 'телефон', 'адрес', 'дата',
+    'день', 'месяц', 'год', 'лет', 'часов', 'минут',
+    'квартира', 'подъезд', 'этаж', 'дом', 'улица', 'сообщу'
+])
+
+
 def clean_name_text(text: str) -> str:
     """Очищает захваченный текст имени от лишних данных"""
     if not text:
         return text
     
-    text = re.sub(r'\s+', ' ', text.strip())
-    
-    stop_words = ['время', 'место', 'номер', 'телефон', 'адрес', 'дата', 
-                  'день', 'месяц', 'год', 'лет', 'часов', 'минут',
-                  'квартира', 'подъезд', 'этаж', 'дом', 'улица', 'сообщу']
+    text = _WS.sub(' ', text.strip())
     
     words = text.split()
     cleaned_words = []
@@ -128,7 +168,7 @@ def clean_name_text(text: str) -> str:
         if not word_clean:
             continue
         
-        if word_clean.lower() in stop_words:
+        if word_clean.lower() in _STOP_WORDS:
             break
         
         if word_clean[0].isupper() and (word_clean.replace('-', '').isalpha() or 
@@ -158,7 +198,7 @@ def clean_address_text(text: str) -> str:
     if not text:
         return text
     
-    text = re.sub(r'\s+', ' ', text.strip())
+    text = _WS.sub(' ', text.strip())
     text = text.rstrip('.,!?;:')
     
     if len(text) > 200:
@@ -175,43 +215,48 @@ def clean_address_text(text: str) -> str:
 
 # --- Логика управления метками ---
 
+_LABEL_MAP = {
+    "PER": "ИМЯ",
+    "PERSON": "ИМЯ",
+    "ORG": "ОРГАНИЗАЦИЯ",
+    "LOC": "АДРЕС",
+    "PHONE_NUMBER": "ТЕЛЕФОН",
+    "INN": "ИНН",
+    "PASSPORT": "ПАСПОРТ",
+    "ADDRESS": "АДРЕС",
+    "LOCATION": "АДРЕС"
+}
+
+
 class RequestAnonymizer:
     """Класс для обработки одного конкретного запроса"""
     
+    # Экземпляр создается на каждый запрос, __slots__ убирает у него __dict__
+    __slots__ = ("counters", "mapping")
+    
+    # Общий для всех запросов, не пересоздается в __init__
+    label_map = _LABEL_MAP
+    
     def __init__(self):
-        self.counters = {}
+        self.counters = defaultdict(int)
         self.mapping = {}
-        self.label_map = {
-            "PER": "ИМЯ",
-            "PERSON": "ИМЯ",
-            "ORG": "ОРГАНИЗАЦИЯ",
-            "LOC": "АДРЕС",
-            "PHONE_NUMBER": "ТЕЛЕФОН",
-            "INN": "ИНН",
-            "PASSPORT": "ПАСПОРТ",
-            "ADDRESS": "АДРЕС",
-            "LOCATION": "АДРЕС"
-        }
     
     def get_replacement(self, original_text: str, entity_type: str) -> str:
         """Получает метку-замену для сущности"""
         ru_label = self.label_map.get(entity_type, entity_type)
         
-        if ru_label not in self.counters:
-            self.counters[ru_label] = 1
-        
+        # Счетчик только растет, поэтому каждая метка новая и в mapping ее еще нет
+        self.counters[ru_label] += 1
         placeholder = f"{{{ru_label}_{self.counters[ru_label]}}}"
         
-        if placeholder not in self.mapping:
-            if entity_type in ["PERSON", "PER"]:
-                cleaned_text = clean_name_text(original_text)
-                self.mapping[placeholder] = cleaned_text if cleaned_text else original_text
-            elif entity_type in ["ADDRESS", "LOCATION", "LOC"]:
-                cleaned_text = clean_address_text(original_text)
-                self.mapping[placeholder] = cleaned_text if cleaned_text else original_text
-            else:
-                self.mapping[placeholder] = original_text
-            self.counters[ru_label] += 1
+        if entity_type in ["PERSON", "PER"]:
+            cleaned_text = clean_name_text(original_text)
+            self.mapping[placeholder] = cleaned_text if cleaned_text else original_text
+        elif entity_type in ["ADDRESS", "LOCATION", "LOC"]:
+            cleaned_text = clean_address_text(original_text)
+            self.mapping[placeholder] = cleaned_text if cleaned_text else original_text
+        else:
+            self.mapping[placeholder] = original_text
         
         return placeholder
 
@@ -228,6 +273,15 @@ class AnonymizeResponse(BaseModel):
     processing_time: float
 
 
+class BulkAnonymizeRequest(BaseModel):
+    texts: List[str]
+
+
+class BulkAnonymizeResponse(BaseModel):
+    results: List[AnonymizeResponse]
+    processing_time: float
+
+
 class DeanonymizeRequest(BaseModel):
     text: str
     mapping: Dict[str, str]
@@ -239,14 +293,37 @@ class DeanonymizeResponse(BaseModel):
 
 # --- Основная функция распознавания ---
 
-def recognize_entities(text: str) -> List[Dict]:
-    """Распознает все сущности в тексте используя NER модель и паттерны"""
-    all_results = []
+def _run_ner_pipeline(texts: List[str]) -> List[List[Dict]]:
+    """Размечает батч текстов ner_pipeline"""
+    try:
+        return ner_pipeline(texts, batch_size=len(texts))
+    except Exception as e:
+        print(f"Ошибка при использовании NER модели: {e}")
     
-    # 1. Используем NER модель если доступна
+    # Ошибка на одном тексте не должна оставить без NER весь батч
+    outputs = []
+    for text in texts:
+        try:
+            outputs.append(ner_pipeline(text))
+        except Exception as e:
+            print(f"Ошибка при использовании NER модели: {e}")
+            outputs.append([])
+    return outputs
+
+
+ner_batcher = NerBatcher(_run_ner_pipeline)
+
+
+async def recognize_entities_with_ner(text: str) -> List[Dict]:
+    """Распознает сущности NER моделью"""
+    results = []
+    
+    if not ner_pipeline_loaded.done():
+        await asyncio.wrap_future(ner_pipeline_loaded)
     if ner_pipeline:
         try:
-            ner_results = ner_pipeline(text)
+            # Текст уходит в общий батч вместе с другими запросами
+            ner_results, = await ner_batcher.submit([text])
             
             for result in ner_results:
                 entity_type = result.get("entity_group", "").upper()
@@ -259,7 +336,7 @@ def recognize_entities(text: str) -> List[Dict]:
                     # Организации пока не анонимизируем, но можем добавить
                     continue
                 
-                all_results.append({
+                results.append({
                     "entity": entity_type,
                     "start": result.get("start", 0),
                     "end": result.get("end", 0),
@@ -269,55 +346,76 @@ def recognize_entities(text: str) -> List[Dict]:
         except Exception as e:
             print(f"Ошибка при использовании NER модели: {e}")
     
-    # 2. Используем паттерны для дополнительного распознавания
-    pattern_results = pattern_recognizer.recognize(text)
+    return results
+
+
+async def recognize_entities(text: str) -> List[Dict]:
+    """Распознает все сущности в тексте используя NER модель и паттерны"""
+    # 1. Используем NER модель если доступна
+    # 2. Тем временем паттерны для дополнительного распознавания считаются
+    # в пуле потоков, чтобы регулярки не блокировали event loop
+    all_results, pattern_results = await asyncio.gather(
+        recognize_entities_with_ner(text),
+        run_in_threadpool(pattern_recognizer.recognize, text)
+    )
     
     # 3. Объединяем результаты, удаляя дубликаты
     all_results.extend(pattern_results)
     
-    # 4. Удаляем перекрывающиеся результаты (оставляем с большим score)
+    # 4. Удаляем перекрывающиеся результаты (оставляем с большим score).
+    # Оставленные результаты не пересекаются и идут по возрастанию start,
+    # поэтому новый результат может пересечься только с последним из них
     filtered_results = []
     all_results = sorted(all_results, key=lambda x: (x["start"], -x["score"]))
     
     for result in all_results:
-        overlaps = False
-        for existing in filtered_results:
-            if not (result["end"] <= existing["start"] or result["start"] >= existing["end"]):
-                overlaps = True
-                if result["score"] > existing["score"]:
-                    filtered_results.remove(existing)
-                    filtered_results.append(result)
-                break
-        
-        if not overlaps:
+        if filtered_results and result["start"] < filtered_results[-1]["end"]:
+            if result["score"] > filtered_results[-1]["score"]:
+                filtered_results[-1] = result
+        else:
             filtered_results.append(result)
     
-    return sorted(filtered_results, key=lambda x: x["start"])
+    return filtered_results
 
 
 # --- Эндпоинты ---
 
-@app.post("/anonymize", response_model=AnonymizeResponse)
-async def anonymize_text(req: AnonymizeRequest):
+@app.on_event("startup")
+async def start_ner_batcher():
+    if ner_pipeline:
+        ner_batcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_ner_batcher():
+    await ner_batcher.stop()
+
+
+async def anonymize_one(text: str) -> AnonymizeResponse:
+    """Анонимизирует один текст со своим набором меток"""
     start_time = time.time()
     
     manager = RequestAnonymizer()
     
     # Распознаем сущности
-    entities = recognize_entities(req.text)
+    entities = await recognize_entities(text)
     
-    # Создаем анонимизированный текст
-    anonymized_text = req.text
-    # Заменяем с конца, чтобы не сбить индексы
-    for entity in reversed(entities):
-        entity_type = entity["entity"]
-        original_text = entity["text"]
-        placeholder = manager.get_replacement(original_text, entity_type)
-        
-        start = entity["start"]
-        end = entity["end"]
-        
-        anonymized_text = anonymized_text[:start] + placeholder + anonymized_text[end:]
+    # Метки выдаем с конца текста, как и раньше, чтобы не поменялась нумерация
+    placeholders = [
+        manager.get_replacement(entity["text"], entity["entity"])
+        for entity in reversed(entities)
+    ]
+    placeholders.reverse()
+    
+    # Собираем анонимизированный текст за один проход слева направо
+    parts = []
+    cursor = 0
+    for entity, placeholder in zip(entities, placeholders):
+        parts.append(text[cursor:entity["start"]])
+        parts.append(placeholder)
+        cursor = entity["end"]
+    parts.append(text[cursor:])
+    anonymized_text = "".join(parts)
     
     return AnonymizeResponse(
         anonymized_text=anonymized_text,
@@ -326,15 +424,27 @@ async def anonymize_text(req: AnonymizeRequest):
     )
 
 
+@app.post("/anonymize", response_model=AnonymizeResponse)
+async def anonymize_text(req: AnonymizeRequest):
+    return await anonymize_one(req.text)
+
+
+@app.post("/bulk_anonymize", response_model=BulkAnonymizeResponse)
+async def bulk_anonymize_text(req: BulkAnonymizeRequest):
+    """Анонимизирует список текстов за один запрос"""
+    start_time = time.time()
+    # Тексты обрабатываются одновременно, поэтому попадают
+    # в общие батчи NerBatcher, а не идут в модель по одному
+    results = await asyncio.gather(*(anonymize_one(text) for text in req.texts))
+    return BulkAnonymizeResponse(
+        results=results,
+        processing_time=time.time() - start_time
+    )
+
+
 @app.post("/deanonymize", response_model=DeanonymizeResponse)
 async def deanonymize_text(req: DeanonymizeRequest):
-    text = req.text
-    mapping = req.mapping
-    
-    for placeholder in sorted(mapping.keys(), key=len, reverse=True):
-        text = text.replace(placeholder, mapping[placeholder])
-    
-    return DeanonymizeResponse(restored_text=text)
+    return DeanonymizeResponse(restored_text=restore_text(req.text, req.mapping))
 
 
 @app.get("/health")
@@ -0,0 +1,109 @@
+"""
+Динамический батчинг NER, общий для main.py и main_advanced.py
+"""
+import asyncio
+import bisect
+import os
+from collections import defaultdict
+from typing import Any, Callable, List
+
+# Тексты одновременных запросов копятся до NER_MAX_BATCH штук
+# или NER_MAX_WAIT_MS миллисекунд и идут в модель одним вызовом
+NER_MAX_BATCH = int(os.getenv("NER_MAX_BATCH", "16"))
+NER_MAX_WAIT = float(os.getenv("NER_MAX_WAIT_MS", "20")) / 1000
+# Границы корзин по числу слов: <16, 16-64, 64-256, >256
+NER_LENGTH_BUCKETS = (16, 64, 256)
+
+
+class NerBatcher:
+    """Собирает тексты одновременных запросов в общий батч для модели.
+
+    run_batch(texts) вызывается в пуле потоков и возвращает по одному ответу
+    на каждый текст. Если он упал на батче, тексты повторяются по одному,
+    и исключение получают только запросы, чей текст упал и в одиночку
+    """
+
+    def __init__(self, run_batch: Callable[[List[str]], List[Any]],
+                 max_batch: int = NER_MAX_BATCH, max_wait: float = NER_MAX_WAIT):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.loop = None
+        self.queue = None
+        self.worker = None
+
+    def start(self):
+        """Запускает фоновый обработчик в текущем event loop"""
+        loop = asyncio.get_running_loop()
+        if self.loop is loop and self.worker is not None and not self.worker.done():
+            return
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.worker = loop.create_task(self._run())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+
+    async def submit(self, texts: List[str]) -> List[Any]:
+        """Ставит тексты в очередь и ждет ответ модели для каждого"""
+        self.start()
+        futures = []
+        for text in texts:
+            future = self.loop.create_future()
+            self.queue.put_nowait((text, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def _collect_batch(self):
+        batch = [await self.queue.get()]
+        deadline = self.loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - self.loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            # Короткие и длинные тексты в одном батче дополнялись бы
+            # паддингом до самого длинного, поэтому модель вызывается по корзинам
+            buckets = defaultdict(list)
+            for item in batch:
+                buckets[bisect.bisect(NER_LENGTH_BUCKETS, len(item[0].split()))].append(item)
+
+            for bucket in buckets.values():
+                await self._process_bucket(bucket)
+
+    async def _process_bucket(self, bucket):
+        texts = [text for text, _ in bucket]
+        try:
+            # Модель блокирует поток, поэтому уводим ее из event loop
+            outputs = await self.loop.run_in_executor(None, self.run_batch, texts)
+        except Exception as e:
+            if len(bucket) == 1:
+                # Ошибку получит и залогирует запрос, чей это текст
+                _, future = bucket[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # Один плохой текст не должен оставить без NER весь батч:
+            # повторяем тексты по одному, ошибку получат только те, что упали сами
+            print(f"Ошибка NER на батче из {len(bucket)} текстов, повторяем по одному: {e}")
+            for item in bucket:
+                await self._process_bucket([item])
+            return
+
+        for (_, future), output in zip(bucket, outputs):
+            if not future.done():
+                future.set_result(output)
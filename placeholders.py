@@ -0,0 +1,65 @@
+"""
+Восстановление исходного текста по маппингу меток, общее для всех сервисов
+"""
+import re
+from typing import Dict
+
+# pyahocorasick (опционально) - восстановление текста за один проход
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    print("pyahocorasick не установлен, используется re. Установите: pip install pyahocorasick")
+    AHOCORASICK_AVAILABLE = False
+
+
+def restore_with_regex(text: str, mapping: Dict[str, str]) -> str:
+    """Одна альтернация по всем меткам. Длинные метки идут первыми,
+    поэтому в каждой позиции выбирается самое длинное совпадение"""
+    placeholders = [placeholder for placeholder in mapping if placeholder]
+    if not placeholders:
+        return text
+
+    pattern = re.compile("|".join(map(re.escape, sorted(placeholders, key=len, reverse=True))))
+    return pattern.sub(lambda match: mapping[match.group()], text)
+
+
+def restore_with_automaton(text: str, mapping: Dict[str, str]) -> str:
+    """То же, что restore_with_regex, но одним проходом Aho-Corasick"""
+    placeholders = [placeholder for placeholder in mapping if placeholder]
+    if not placeholders:
+        return text
+
+    automaton = ahocorasick.Automaton()
+    for placeholder in placeholders:
+        automaton.add_word(placeholder, (len(placeholder), mapping[placeholder]))
+    automaton.make_automaton()
+
+    # iter() отдает все вхождения, в том числе вложенные. Для каждой позиции
+    # начала оставляем самое длинное - iter_long для этого не годится: он
+    # теряет последнее совпадение, если в конце текста не дочитан более длинный ключ
+    longest = {}
+    for end, (length, value) in automaton.iter(text):
+        start = end - length + 1
+        if start not in longest or longest[start][0] < end:
+            longest[start] = (end, value)
+
+    # Дальше как у re.sub: слева направо, пропуская пересечения с уже замененным
+    parts = []
+    cursor = 0
+    for start in sorted(longest):
+        if start < cursor:
+            continue
+        end, value = longest[start]
+        parts.append(text[cursor:start])
+        parts.append(value)
+        cursor = end + 1
+    parts.append(text[cursor:])
+    return "".join(parts)
+
+
+def restore_text(text: str, mapping: Dict[str, str]) -> str:
+    """Подставляет исходные значения вместо меток"""
+    if AHOCORASICK_AVAILABLE:
+        return restore_with_automaton(text, mapping)
+    return restore_with_regex(text, mapping)
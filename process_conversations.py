@@ -1,6 +1,8 @@
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 from docx import Document
 from typing import List, Dict
@@ -8,9 +10,19 @@ import json
 
 # Конфигурация
 API_ENDPOINT = "http://155.212.191.224:8000/anonymize"
+BULK_API_ENDPOINT = API_ENDPOINT.rsplit("/", 1)[0] + "/bulk_anonymize"
+# Сколько сообщений отправлять в одном запросе к /bulk_anonymize
+BATCH_SIZE = 32
+# Сколько запросов к API держать в работе одновременно
+MAX_WORKERS = 8
 INPUT_FILE = "переписки с клиентами реальные.docx"
 OUTPUT_FILE = "anonymization_results.xlsx"
 
+# Одна сессия на все запросы: соединения с API переиспользуются (keep-alive)
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+session.mount("https://", HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
 def read_docx(file_path: str) -> str:
     """Читает содержимое .docx файла"""
     doc = Document(file_path)
@@ -43,7 +55,7 @@ def parse_messages(text: str) -> List[Dict[str, str]]:
 def anonymize_text(text: str) -> Dict:
     """Отправляет текст на API для анонимизации"""
     try:
-        response = requests.post(
+        response = session.post(
             API_ENDPOINT,
             json={"text": text},
             headers={"Content-Type": "application/json"},
@@ -55,6 +67,63 @@ def anonymize_text(text: str) -> Dict:
         print(f"Ошибка при запросе к API: {e}")
         return None
 
+def anonymize_batch(texts: List[str]) -> List[Dict]:
+    """Отправляет пачку текстов на /bulk_anonymize, ответы идут в том же порядке"""
+    try:
+        response = session.post(
+            BULK_API_ENDPOINT,
+            json={"texts": texts},
+            headers={"Content-Type": "application/json"},
+            timeout=30 + 5 * len(texts)
+        )
+        response.raise_for_status()
+        return response.json()["results"]
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        print(f"Ошибка при пакетном запросе к API: {e}")
+        return None
+
+def make_result(i: int, message: Dict[str, str], api_response: Dict, request_time: float) -> Dict:
+    """Строка итоговой таблицы для одного сообщения"""
+    if api_response:
+        print(f"✓ Сообщение {i} обработано за {api_response.get('processing_time', request_time):.3f} сек")
+        return {
+            'Номер сообщения': i,
+            'Отправитель': message['sender'],
+            'Изначальное сообщение': message['text'],
+            'Анонимный результат': api_response.get('anonymized_text', ''),
+            'Время обработки (сек)': api_response.get('processing_time', request_time),
+            'Время запроса (сек)': request_time,
+            'Маппинг': json.dumps(api_response.get('mapping', {}), ensure_ascii=False)
+        }
+    
+    print(f"✗ Ошибка при обработке сообщения {i}")
+    return {
+        'Номер сообщения': i,
+        'Отправитель': message['sender'],
+        'Изначальное сообщение': message['text'],
+        'Анонимный результат': 'ОШИБКА',
+        'Время обработки (сек)': 0,
+        'Время запроса (сек)': request_time,
+        'Маппинг': ''
+    }
+
+def send_batch(batch: List[Dict[str, str]]) -> List[tuple]:
+    """Анонимизирует пачку сообщений, возвращает пары (ответ API, время запроса)"""
+    start_time = time.time()
+    api_responses = anonymize_batch([message['text'] for message in batch])
+    if api_responses is not None:
+        # Время пачки делим поровну между ее сообщениями
+        request_time = (time.time() - start_time) / len(batch)
+        return [(api_response, request_time) for api_response in api_responses]
+    
+    # Сервер без /bulk_anonymize или ошибка пачки - отправляем по одному
+    results = []
+    for message in batch:
+        start_time = time.time()
+        api_response = anonymize_text(message['text'])
+        results.append((api_response, time.time() - start_time))
+    return results
+
 def process_conversations():
     """Основная функция обработки переписки"""
     print(f"Чтение файла: {INPUT_FILE}")
@@ -75,43 +144,17 @@ def process_conversations():
         print("Сообщения не найдены. Проверьте формат файла.")
         return
     
-    # Обрабатываем каждое сообщение
+    # Сообщения уходят пачками по BATCH_SIZE в /bulk_anonymize: модель
+    # размечает их общими батчами, и нет паузы между отдельными запросами.
+    # До MAX_WORKERS пачек отправляются одновременно, map сохраняет порядок
+    batches = [messages[start:start + BATCH_SIZE] for start in range(0, len(messages), BATCH_SIZE)]
+    print(f"Отправка {len(batches)} пачек по {BATCH_SIZE} сообщений...")
     results = []
     
-    for i, message in enumerate(messages, 1):
-        print(f"\nОбработка сообщения {i}/{len(messages)} ({message['sender']})...")
-        print(f"Текст: {message['text'][:100]}...")
-        
-        # Отправляем на анонимизацию
-        start_time = time.time()
-        api_response = anonymize_text(message['text'])
-        request_time = time.time() - start_time
-        
-        if api_response:
-            results.append({
-                'Номер сообщения': i,
-                'Отправитель': message['sender'],
-                'Изначальное сообщение': message['text'],
-                'Анонимный результат': api_response.get('anonymized_text', ''),
-                'Время обработки (сек)': api_response.get('processing_time', request_time),
-                'Время запроса (сек)': request_time,
-                'Маппинг': json.dumps(api_response.get('mapping', {}), ensure_ascii=False)
-            })
-            print(f"✓ Успешно обработано за {api_response.get('processing_time', request_time):.3f} сек")
-        else:
-            results.append({
-                'Номер сообщения': i,
-                'Отправитель': message['sender'],
-                'Изначальное сообщение': message['text'],
-                'Анонимный результат': 'ОШИБКА',
-                'Время обработки (сек)': 0,
-                'Время запроса (сек)': request_time,
-                'Маппинг': ''
-            })
-            print("✗ Ошибка при обработке")
-        
-        # Небольшая задержка между запросами
-        time.sleep(0.5)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        for batch, batch_results in zip(batches, pool.map(send_batch, batches)):
+            for message, (api_response, request_time) in zip(batch, batch_results):
+                results.append(make_result(len(results) + 1, message, api_response, request_time))
     
     # Сохраняем результаты в Excel
     print(f"\nСохранение результатов в {OUTPUT_FILE}...")
@@ -17,6 +17,10 @@ line_patterns = [
     r"(?i)\d+(?:-я|-й|-е|-ая|-ый|-ое)?\s+линия(?:\s+[А-ЯЁа-яё\.]+)?(?:\s*[,]?\s*)?(?:д\.?\s*\d+[А-ЯЁа-яё]?|дом\s*\d+[А-ЯЁа-яё]?)?",
 ]
 
+# Компилируем один раз, чтобы файл можно было гонять и как замер времени
+prospect_patterns = [re.compile(pattern) for pattern in prospect_patterns]
+line_patterns = [re.compile(pattern) for pattern in line_patterns]
+
 print("Тестирование паттернов адресов:")
 print("=" * 60)
 print(f"Текст: {test_text}")
@@ -24,8 +28,8 @@ print("=" * 60)
 
 print("\nПоиск 'северный пр 69':")
 for i, pattern in enumerate(prospect_patterns):
-    matches = list(re.finditer(pattern, test_text))
-    print(f"  Паттерн {i+1}: {pattern}")
+    matches = list(pattern.finditer(test_text))
+    print(f"  Паттерн {i+1}: {pattern.pattern}")
     if matches:
         for match in matches:
             print(f"    ✓ Найдено: '{match.group()}' (позиция {match.start()}-{match.end()})")
@@ -34,8 +38,8 @@ for i, pattern in enumerate(prospect_patterns):
 
 print("\nПоиск '4 линия д.41':")
 for i, pattern in enumerate(line_patterns):
-    matches = list(re.finditer(pattern, test_text))
-    print(f"  Паттерн {i+1}: {pattern}")
+    matches = list(pattern.finditer(test_text))
+    print(f"  Паттерн {i+1}: {pattern.pattern}")
     if matches:
         for match in matches:
             print(f"    ✓ Найдено: '{match.group()}' (позиция {match.start()}-{match.end()})")
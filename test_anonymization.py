@@ -1,34 +1,107 @@
 """
 Тесты для проверки детекции персональной информации
 """
+import re
 import pytest
-import requests
+import httpx
 import json
-import os
 from typing import Dict, List
 
 
-# Базовый URL API (можно переопределить через переменную окружения)
-API_URL = os.getenv("ANONYMIZER_API_URL", "http://localhost:8000/anonymize")
+# Метка в анонимизированном тексте, например {ИМЯ_1}
+_PLACEHOLDER_RE = re.compile(r'\{[А-ЯЁ_]+_\d+\}')
+
+
+# Входные тексты тестов. Все они уходят в API одним запросом к /bulk_anonymize,
+# так что сервер разбирает их предложения общими батчами NER
+TEXTS = {
+    "simple_name_detection": "Меня зовут Иван Иванов",
+    "name_with_age": "Алиса, 6 лет",
+    "multiple_names": "Варвара и Екатерина пришли на встречу",
+    "name_with_stop_word": "Имя Варвара\nВремя 17:00",
+    "phone_with_plus": "Мой номер +79818122189",
+    "phone_with_8": "Позвоните по номеру 89001234567",
+    "phone_with_spaces": "Телефон: 8 900 123 45 67",
+    "phone_with_name": "+79500054031 Екатерина",
+    "full_address": "г. Москва, ул. Новая, д. 1, кв. 5",
+    "street_with_number": "Кавалергардская 12Б",
+    "prospect_short": "северный пр 69",
+    "line_address": "4 линия д.41",
+    "highway_address": "Южное шоссе, д. 53 к 4",
+    "metro_address": "метро площадь Ленина, 10 минут от метро. Комсомола 7",
+    "apartment_details": "Квартира 23, 3 парадная",
+    "navigation_address": "по навигатору Яндекса - это Кирочная 54К",
+    "inn_10_digits": "ИНН: 1234567890",
+    "inn_12_digits": "ИНН организации: 123456789012",
+    "passport_with_series": "Паспорт серия 1234 номер 567890",
+    "passport_format": "Паспорт 12 34 567890",
+    "multiple_entities": "Иван Иванов, телефон +79001234567, адрес: г. Москва, ул. Ленина, д. 1",
+    "example_1": """Номер +79818122189
+Имя Варвара
+Время 17:00
+Место сообщу завтра""",
+    "example_2": """Знает, ждёт)
+Алиса, 6 лет.
+Кавалергардская 12Б, по навигатору Яндекса - это Кирочная 54К, проезду и проход с Мариинского. Я прикреплю скрин, чтобы понятно было.
+Квартира 23, 3 парадная.
+Если погода будет позволять и не будет дождя, то планируется на улице анимация, в сквере напротив дома. Вещи можно будет оставить в квартире.
++79500054031 Екатерина""",
+    "example_3": """Здравствуйте!14 сентября день рождения у дочки. 5 лет. Друзей нет ещё. Можно ли заказать у вас аниматора "Леди Баг" На детскую площадку у дома? Вручить подарок с шариками, потанцевать. И в общем, сколько это будет стоить? Мы живём: метро площадь Ленина, 10 минут от метро. Комсомола 7.""",
+    "example_4": """Очень неудобно, что у вас такая связь, общение не 1 раз и сразу. А несколько дней с промежутком в 8 часов :(
+22 ноября 13.00
+Южное шоссе, д. 53 к 4
+Мой номер 89650809493, Елена.
+День рождения у Анны 7 лет.
+Детей будет 7-8 человек.
+Я хочу поговорить с аниматором, который приедет, и обсудить детали""",
+    "processing_time": "Иван Иванов, телефон +79001234567",
+    "mapping_consistency": "Иван Иванов",
+    "no_false_positives": "Сегодня хорошая погода. Температура 25 градусов.",
+}
+
+
+@pytest.fixture(scope="module")
+def batch_results(client):
+    """Результаты анонимизации всех TEXTS, полученные одним запросом"""
+    try:
+        response = client.post("/bulk_anonymize", json={"texts": list(TEXTS.values())})
+        if response.status_code not in (404, 405):
+            response.raise_for_status()
+            return dict(zip(TEXTS, response.json()["results"]))
+
+        # У сервера нет /bulk_anonymize (старая версия или другой сервис) -
+        # отправляем тексты по одному
+        results = {}
+        for name, text in TEXTS.items():
+            response = client.post("/anonymize", json={"text": text})
+            response.raise_for_status()
+            results[name] = response.json()
+        return results
+    except httpx.TransportError as e:
+        pytest.skip(f"API недоступен: {e}")
 
 
 class TestPersonalDataDetection:
     """Тесты для проверки детекции персональных данных"""
     
-    def send_request(self, text: str) -> Dict:
-        """Отправляет запрос на анонимизацию"""
+    @pytest.fixture(autouse=True)
+    def _use_client(self, client, batch_results):
+        self.client = client
+        self.batch_results = batch_results
+    
+    def post(self, path: str, payload: Dict) -> Dict:
+        """Отправляет запрос к API и возвращает JSON ответа"""
         try:
-            response = requests.post(
-                API_URL,
-                json={"text": text},
-                headers={"Content-Type": "application/json"},
-                timeout=30
-            )
+            response = self.client.post(path, json=payload)
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.RequestException as e:
+        except httpx.TransportError as e:
             pytest.skip(f"API недоступен: {e}")
     
+    def send_request(self, text: str) -> Dict:
+        """Отправляет запрос на анонимизацию"""
+        return self.post("/anonymize", {"text": text})
+    
     def assert_entity_detected(self, response: Dict, entity_type: str, original_value: str):
         """Проверяет, что сущность была обнаружена и заменена"""
         anonymized_text = response.get("anonymized_text", "")
@@ -37,7 +110,7 @@ class TestPersonalDataDetection:
         # Проверяем, что оригинальное значение было заменено (или частично заменено)
         # Для некоторых случаев оригинальное значение может быть частично видно
         original_lower = original_value.lower()
-        anonymized_lower = anonymized_text.lower()
+        original_words = [word for word in original_lower.split() if len(word) > 2]
         
         # Проверяем, что в маппинге есть соответствующая метка
         found = False
@@ -45,7 +118,8 @@ class TestPersonalDataDetection:
         for placeholder, value in mapping.items():
             if entity_type in placeholder:
                 # Проверяем, содержит ли значение оригинальные данные
-                if original_lower in value.lower() or any(word in value.lower() for word in original_lower.split() if len(word) > 2):
+                value_lower = value.lower()
+                if original_lower in value_lower or any(word in value_lower for word in original_words):
                     found = True
                     found_placeholder = placeholder
                     assert placeholder in anonymized_text, \
@@ -60,24 +134,21 @@ class TestPersonalDataDetection:
     
     def test_simple_name_detection(self):
         """Тест: Простое имя"""
-        text = "Меня зовут Иван Иванов"
-        response = self.send_request(text)
+        response = self.batch_results["simple_name_detection"]
         
         assert "Иван" in response["anonymized_text"] or "{ИМЯ" in response["anonymized_text"]
         self.assert_entity_detected(response, "ИМЯ", "Иван")
     
     def test_name_with_age(self):
         """Тест: Имя с возрастом"""
-        text = "Алиса, 6 лет"
-        response = self.send_request(text)
+        response = self.batch_results["name_with_age"]
         
         self.assert_entity_detected(response, "ИМЯ", "Алиса")
         assert "6 лет" in response["anonymized_text"]  # Возраст не должен заменяться
     
     def test_multiple_names(self):
         """Тест: Несколько имен"""
-        text = "Варвара и Екатерина пришли на встречу"
-        response = self.send_request(text)
+        response = self.batch_results["multiple_names"]
         
         mapping = response.get("mapping", {})
         name_placeholders = [k for k in mapping.keys() if "ИМЯ" in k]
@@ -85,8 +156,7 @@ class TestPersonalDataDetection:
     
     def test_name_with_stop_word(self):
         """Тест: Имя не должно захватывать стоп-слова"""
-        text = "Имя Варвара\nВремя 17:00"
-        response = self.send_request(text)
+        response = self.batch_results["name_with_stop_word"]
         
         mapping = response.get("mapping", {})
         # Проверяем, что в маппинге имени нет слова "Время"
@@ -99,22 +169,19 @@ class TestPersonalDataDetection:
     
     def test_phone_with_plus(self):
         """Тест: Телефон с плюсом"""
-        text = "Мой номер +79818122189"
-        response = self.send_request(text)
+        response = self.batch_results["phone_with_plus"]
         
         self.assert_entity_detected(response, "ТЕЛЕФОН", "+79818122189")
     
     def test_phone_with_8(self):
         """Тест: Телефон начинающийся с 8"""
-        text = "Позвоните по номеру 89001234567"
-        response = self.send_request(text)
+        response = self.batch_results["phone_with_8"]
         
         self.assert_entity_detected(response, "ТЕЛЕФОН", "89001234567")
     
     def test_phone_with_spaces(self):
         """Тест: Телефон с пробелами"""
-        text = "Телефон: 8 900 123 45 67"
-        response = self.send_request(text)
+        response = self.batch_results["phone_with_spaces"]
         
         # Проверяем, что телефон был обнаружен (может быть с пробелами или без)
         anonymized = response["anonymized_text"]
@@ -122,8 +189,7 @@ class TestPersonalDataDetection:
     
     def test_phone_with_name(self):
         """Тест: Телефон с именем"""
-        text = "+79500054031 Екатерина"
-        response = self.send_request(text)
+        response = self.batch_results["phone_with_name"]
         
         self.assert_entity_detected(response, "ТЕЛЕФОН", "+79500054031")
         self.assert_entity_detected(response, "ИМЯ", "Екатерина")
@@ -132,8 +198,7 @@ class TestPersonalDataDetection:
     
     def test_full_address(self):
         """Тест: Полный адрес"""
-        text = "г. Москва, ул. Новая, д. 1, кв. 5"
-        response = self.send_request(text)
+        response = self.batch_results["full_address"]
         
         assert "{АДРЕС" in response["anonymized_text"]
         mapping = response.get("mapping", {})
@@ -142,15 +207,13 @@ class TestPersonalDataDetection:
     
     def test_street_with_number(self):
         """Тест: Улица с номером дома"""
-        text = "Кавалергардская 12Б"
-        response = self.send_request(text)
+        response = self.batch_results["street_with_number"]
         
         self.assert_entity_detected(response, "АДРЕС", "Кавалергардская")
     
     def test_prospect_short(self):
         """Тест: Проспект с сокращением 'пр'"""
-        text = "северный пр 69"
-        response = self.send_request(text)
+        response = self.batch_results["prospect_short"]
         
         anonymized = response["anonymized_text"]
         mapping = response.get("mapping", {})
@@ -170,8 +233,7 @@ class TestPersonalDataDetection:
     
     def test_line_address(self):
         """Тест: Линия с номером дома"""
-        text = "4 линия д.41"
-        response = self.send_request(text)
+        response = self.batch_results["line_address"]
         
         anonymized = response["anonymized_text"]
         mapping = response.get("mapping", {})
@@ -191,29 +253,25 @@ class TestPersonalDataDetection:
     
     def test_highway_address(self):
         """Тест: Шоссе с домом"""
-        text = "Южное шоссе, д. 53 к 4"
-        response = self.send_request(text)
+        response = self.batch_results["highway_address"]
         
         assert "{АДРЕС" in response["anonymized_text"]
     
     def test_metro_address(self):
         """Тест: Адрес с метро"""
-        text = "метро площадь Ленина, 10 минут от метро. Комсомола 7"
-        response = self.send_request(text)
+        response = self.batch_results["metro_address"]
         
         assert "{АДРЕС" in response["anonymized_text"]
     
     def test_apartment_details(self):
         """Тест: Квартира с подъездом"""
-        text = "Квартира 23, 3 парадная"
-        response = self.send_request(text)
+        response = self.batch_results["apartment_details"]
         
         assert "{АДРЕС" in response["anonymized_text"]
     
     def test_navigation_address(self):
         """Тест: Адрес с навигационными указаниями"""
-        text = "по навигатору Яндекса - это Кирочная 54К"
-        response = self.send_request(text)
+        response = self.batch_results["navigation_address"]
         
         assert "{АДРЕС" in response["anonymized_text"]
     
@@ -221,15 +279,13 @@ class TestPersonalDataDetection:
     
     def test_inn_10_digits(self):
         """Тест: ИНН физического лица (10 цифр)"""
-        text = "ИНН: 1234567890"
-        response = self.send_request(text)
+        response = self.batch_results["inn_10_digits"]
         
         self.assert_entity_detected(response, "ИНН", "1234567890")
     
     def test_inn_12_digits(self):
         """Тест: ИНН юридического лица (12 цифр)"""
-        text = "ИНН организации: 123456789012"
-        response = self.send_request(text)
+        response = self.batch_results["inn_12_digits"]
         
         self.assert_entity_detected(response, "ИНН", "123456789012")
     
@@ -237,15 +293,13 @@ class TestPersonalDataDetection:
     
     def test_passport_with_series(self):
         """Тест: Паспорт с серией"""
-        text = "Паспорт серия 1234 номер 567890"
-        response = self.send_request(text)
+        response = self.batch_results["passport_with_series"]
         
         assert "{ПАСПОРТ" in response["anonymized_text"]
     
     def test_passport_format(self):
         """Тест: Паспорт в формате 12 34 567890"""
-        text = "Паспорт 12 34 567890"
-        response = self.send_request(text)
+        response = self.batch_results["passport_format"]
         
         assert "{ПАСПОРТ" in response["anonymized_text"]
     
@@ -253,8 +307,7 @@ class TestPersonalDataDetection:
     
     def test_multiple_entities(self):
         """Тест: Несколько типов сущностей"""
-        text = "Иван Иванов, телефон +79001234567, адрес: г. Москва, ул. Ленина, д. 1"
-        response = self.send_request(text)
+        response = self.batch_results["multiple_entities"]
         
         mapping = response.get("mapping", {})
         assert any("ИМЯ" in k for k in mapping.keys()), "Имя должно быть обнаружено"
@@ -263,11 +316,7 @@ class TestPersonalDataDetection:
     
     def test_example_1(self):
         """Тест: Пример 1 из examples.py"""
-        text = """Номер +79818122189
-Имя Варвара
-Время 17:00
-Место сообщу завтра"""
-        response = self.send_request(text)
+        response = self.batch_results["example_1"]
         
         self.assert_entity_detected(response, "ТЕЛЕФОН", "+79818122189")
         self.assert_entity_detected(response, "ИМЯ", "Варвара")
@@ -279,13 +328,7 @@ class TestPersonalDataDetection:
     
     def test_example_2(self):
         """Тест: Пример 2 из examples.py"""
-        text = """Знает, ждёт)
-Алиса, 6 лет.
-Кавалергардская 12Б, по навигатору Яндекса - это Кирочная 54К, проезду и проход с Мариинского. Я прикреплю скрин, чтобы понятно было.
-Квартира 23, 3 парадная.
-Если погода будет позволять и не будет дождя, то планируется на улице анимация, в сквере напротив дома. Вещи можно будет оставить в квартире.
-+79500054031 Екатерина"""
-        response = self.send_request(text)
+        response = self.batch_results["example_2"]
         
         self.assert_entity_detected(response, "ИМЯ", "Алиса")
         self.assert_entity_detected(response, "ИМЯ", "Екатерина")
@@ -294,21 +337,13 @@ class TestPersonalDataDetection:
     
     def test_example_3(self):
         """Тест: Пример 3 из examples.py"""
-        text = """Здравствуйте!14 сентября день рождения у дочки. 5 лет. Друзей нет ещё. Можно ли заказать у вас аниматора "Леди Баг" На детскую площадку у дома? Вручить подарок с шариками, потанцевать. И в общем, сколько это будет стоить? Мы живём: метро площадь Ленина, 10 минут от метро. Комсомола 7."""
-        response = self.send_request(text)
+        response = self.batch_results["example_3"]
         
         assert "{АДРЕС" in response["anonymized_text"]
     
     def test_example_4(self):
         """Тест: Пример 4 из examples.py"""
-        text = """Очень неудобно, что у вас такая связь, общение не 1 раз и сразу. А несколько дней с промежутком в 8 часов :(
-22 ноября 13.00
-Южное шоссе, д. 53 к 4
-Мой номер 89650809493, Елена.
-День рождения у Анны 7 лет.
-Детей будет 7-8 человек.
-Я хочу поговорить с аниматором, который приедет, и обсудить детали"""
-        response = self.send_request(text)
+        response = self.batch_results["example_4"]
         
         self.assert_entity_detected(response, "ТЕЛЕФОН", "89650809493")
         self.assert_entity_detected(response, "ИМЯ", "Елена")
@@ -319,8 +354,7 @@ class TestPersonalDataDetection:
     
     def test_processing_time(self):
         """Тест: Время обработки должно быть разумным"""
-        text = "Иван Иванов, телефон +79001234567"
-        response = self.send_request(text)
+        response = self.batch_results["processing_time"]
         
         processing_time = response.get("processing_time", 0)
         assert processing_time < 10.0, f"Время обработки слишком большое: {processing_time} сек"
@@ -329,22 +363,19 @@ class TestPersonalDataDetection:
     
     def test_mapping_consistency(self):
         """Тест: Консистентность маппинга"""
-        text = "Иван Иванов"
-        response = self.send_request(text)
+        response = self.batch_results["mapping_consistency"]
         
         anonymized = response["anonymized_text"]
         mapping = response.get("mapping", {})
         
         # Проверяем, что все метки из текста есть в маппинге
-        import re
-        placeholders = re.findall(r'\{[А-ЯЁ_]+_\d+\}', anonymized)
+        placeholders = _PLACEHOLDER_RE.findall(anonymized)
         for placeholder in placeholders:
             assert placeholder in mapping, f"Метка {placeholder} отсутствует в маппинге"
     
     def test_no_false_positives(self):
         """Тест: Отсутствие ложных срабатываний на обычных словах"""
-        text = "Сегодня хорошая погода. Температура 25 градусов."
-        response = self.send_request(text)
+        response = self.batch_results["no_false_positives"]
         
         mapping = response.get("mapping", {})
         # Не должно быть обнаружено персональных данных в этом тексте
@@ -352,6 +383,26 @@ class TestPersonalDataDetection:
         assert len(mapping) == 0 or all("АДРЕС" not in k or "LOCATION" not in k for k in mapping.keys()), \
             "Не должно быть ложных срабатываний на обычных словах"
 
+    
+    # === ТЕСТЫ ПАКЕТНОЙ АНОНИМИЗАЦИИ ===
+    
+    def test_bulk_anonymize(self, monkeypatch):
+        """Тест: /bulk_anonymize дает тот же результат, что и /anonymize по одному"""
+        if hasattr(self.client, "app"):
+            # Приложение в процессе: выключаем кеш сущностей, иначе одиночные
+            # запросы отдаются из кеша, заполненного bulk-запросом, и совпадают
+            # с ним по построению
+            import main
+            monkeypatch.setattr(main, "ENTITY_CACHE_SIZE", 0)
+            main._entity_cache.clear()
+        
+        texts = ["Иван Иванов, телефон +79001234567", "ИНН: 1234567890", ""]
+        results = self.post("/bulk_anonymize", {"texts": texts})["results"]
+        assert len(results) == len(texts)
+        for text, result in zip(texts, results):
+            single = self.send_request(text)
+            assert result["anonymized_text"] == single["anonymized_text"]
+            assert result["mapping"] == single["mapping"]
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,81 @@
+"""
+Тесты общего батчера NER: ошибка на одном тексте не задевает соседей по батчу
+"""
+import asyncio
+
+import pytest
+
+import main
+from ner_batching import NerBatcher
+
+
+FAILING_TEXT = "СБОЙ модели на этом тексте"
+
+
+def failing_model(texts):
+    """Модель, которая падает на любом батче с FAILING_TEXT"""
+    if FAILING_TEXT in texts:
+        raise RuntimeError("сбой модели")
+    return [text.upper() for text in texts]
+
+
+def stub_ner_model(sentences):
+    """ner_model в формате DeepPavlov: имя Иван размечено как PER"""
+    if FAILING_TEXT in sentences:
+        raise RuntimeError("сбой модели")
+    tokens_batch = [sentence.split() for sentence in sentences]
+    tags_batch = [["B-PER" if token == "Иван" else "O" for token in tokens] for tokens in tokens_batch]
+    return [tokens_batch, tags_batch]
+
+
+class TestNerBatcher:
+    """Тексты одного батча получают ответ или ошибку независимо друг от друга"""
+
+    def test_failure_only_for_failing_text(self):
+        calls = []
+
+        def run_batch(texts):
+            calls.append(list(texts))
+            return failing_model(texts)
+
+        async def run():
+            batcher = NerBatcher(run_batch, max_wait=0.05)
+            try:
+                return await asyncio.gather(
+                    batcher.submit(["первый текст"]),
+                    batcher.submit([FAILING_TEXT]),
+                    batcher.submit(["второй текст"]),
+                    return_exceptions=True,
+                )
+            finally:
+                await batcher.stop()
+
+        first, failed, second = asyncio.run(run())
+        assert first == ["ПЕРВЫЙ ТЕКСТ"]
+        assert second == ["ВТОРОЙ ТЕКСТ"]
+        assert isinstance(failed, RuntimeError)
+        # Сначала общий батч, потом повтор по одному
+        assert calls[0] == ["первый текст", FAILING_TEXT, "второй текст"]
+        assert len(calls) == 4
+
+    def test_anonymize_masks_name_next_to_failing_text(self, monkeypatch):
+        # Фоновая загрузка не должна перезаписать заглушку
+        main.ner_model_loaded.result()
+        monkeypatch.setattr(main, "ner_model", stub_ner_model)
+
+        async def run():
+            try:
+                return await asyncio.gather(
+                    main.anonymize_one("Меня зовут Иван"),
+                    main.anonymize_one(FAILING_TEXT),
+                )
+            finally:
+                await main.ner_batcher.stop()
+
+        named, _ = asyncio.run(run())
+        assert named.anonymized_text == "Меня зовут {ИМЯ_1}"
+        assert named.mapping == {"{ИМЯ_1}": "Иван"}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,52 @@
+"""
+Тесты восстановления текста по маппингу меток
+"""
+import random
+
+import pytest
+
+import placeholders
+
+
+requires_automaton = pytest.mark.skipif(
+    not placeholders.AHOCORASICK_AVAILABLE, reason="pyahocorasick не установлен"
+)
+
+
+class TestRestoreText:
+    """Aho-Corasick и запасная альтернация re восстанавливают одинаково"""
+
+    def test_restores_placeholders(self):
+        mapping = {"{ИМЯ_1}": "Иван", "{ИМЯ_10}": "Алиса", "{ТЕЛЕФОН_1}": "+79001234567"}
+        text = "{ИМЯ_1} и {ИМЯ_10}, {ТЕЛЕФОН_1}"
+        assert placeholders.restore_text(text, mapping) == "Иван и Алиса, +79001234567"
+
+    def test_empty_keys_ignored(self):
+        assert placeholders.restore_text("abc", {"": "x"}) == "abc"
+
+    @requires_automaton
+    def test_pending_longer_key_at_end(self):
+        # Более длинный ключ '_bab' начинается в конце текста, но не дочитан -
+        # короткое совпадение 'b' при этом теряться не должно
+        mapping = {"{b": "0", "b": "1", "b}}": "2", "_bab": "3"}
+        assert placeholders.restore_with_regex("1yx_b", mapping) == "1yx_1"
+        assert placeholders.restore_with_automaton("1yx_b", mapping) == "1yx_1"
+    
+    @requires_automaton
+    def test_automaton_matches_regex_fuzz(self):
+        # Ключи не похожи на метки: короткие строки из маленького алфавита
+        # часто вкладываются друг в друга и пересекаются
+        rng = random.Random(0)
+        alphabet = "{}_bxy1"
+        for _ in range(20000):
+            mapping = {
+                "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 4))): str(i)
+                for i in range(rng.randint(0, 5))
+            }
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+            expected = placeholders.restore_with_regex(text, mapping)
+            assert placeholders.restore_with_automaton(text, mapping) == expected, (text, mapping)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,169 @@
+"""
+Тесты SpaCy_test.py, которым не нужна модель spaCy
+"""
+import random
+import types
+
+import pytest
+
+SpaCy_test = pytest.importorskip("SpaCy_test")
+
+from presidio_analyzer import RecognizerResult
+from presidio_anonymizer import AnonymizerEngine
+from presidio_anonymizer.entities import OperatorConfig
+
+
+DIGIT_ENTITIES = ["INN", "PHONE_NUMBER", "PASSPORT"]
+
+# Тексты, на которых объединенные распознаватели расходились
+# с отдельными PatternRecognizer
+DIGIT_TEXTS = [
+    "ПАСПОРТ СЕРИЯ 4510 НОМЕР 123456",
+    "4510 НОМЕР 123456",
+    "серия 4510 нОмер 123456",
+    "1паспорт 4510 123456",
+    "89001234567 7712345678",
+    "82275757681382с",
+    SpaCy_test.example_4,
+]
+
+FUZZ_TOKENS = [
+    "паспорт", "ПАСПОРТ", "серия", "СЕРИЯ", "номер", "НОМЕР", "нОмер", "ИНН",
+    "+7", "8", "7", " ", "-", "(", ")", "1", "45", "4510", "123456", "900", "67", "с",
+]
+
+
+def fuzz_texts(count, tokens, seed=0):
+    """Случайные склейки токенов, воспроизводимые по seed"""
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choice(tokens) + rng.choice(["", " "]) for _ in range(rng.randint(1, 15)))
+        for _ in range(count)
+    ]
+
+
+def spans(results):
+    return sorted((result.entity_type, result.start, result.end) for result in results)
+
+
+def baseline_spans(text):
+    """Совпадения отдельных PatternRecognizer для каждой сущности"""
+    results = []
+    for name in ("RU_INN", "RU_PHONE", "RU_PASSPORT"):
+        results.extend(SpaCy_test.get_recognizer(name).analyze(text, DIGIT_ENTITIES))
+    return spans(results)
+
+
+class TestDigitPiiRecognizers:
+    """ИНН, телефоны и паспорта совпадают с отдельными рекогнайзерами"""
+
+    @pytest.mark.parametrize("text", DIGIT_TEXTS)
+    def test_regex_recognizer(self, text):
+        recognizer = SpaCy_test.DigitPiiRecognizer()
+        assert spans(recognizer.analyze(text, DIGIT_ENTITIES)) == baseline_spans(text)
+    
+    def test_regex_recognizer_fuzz(self):
+        recognizer = SpaCy_test.DigitPiiRecognizer()
+        for text in fuzz_texts(2000, FUZZ_TOKENS):
+            assert spans(recognizer.analyze(text, DIGIT_ENTITIES)) == baseline_spans(text), text
+    
+    @pytest.mark.skipif(not SpaCy_test.HYPERSCAN_AVAILABLE, reason="Hyperscan не установлен")
+    @pytest.mark.parametrize("text", DIGIT_TEXTS)
+    def test_hyperscan_recognizer(self, text):
+        recognizer = SpaCy_test.HyperscanRecognizer()
+        assert spans(recognizer.analyze(text, DIGIT_ENTITIES)) == baseline_spans(text)
+    
+    @pytest.mark.skipif(not SpaCy_test.HYPERSCAN_AVAILABLE, reason="Hyperscan не установлен")
+    def test_hyperscan_recognizer_fuzz(self):
+        recognizer = SpaCy_test.HyperscanRecognizer()
+        for text in fuzz_texts(2000, FUZZ_TOKENS):
+            assert spans(recognizer.analyze(text, DIGIT_ENTITIES)) == baseline_spans(text), text
+
+
+def random_results(rng, text):
+    """Случайные, в том числе пересекающиеся и пустые, сущности в тексте"""
+    results = []
+    for _ in range(rng.randint(0, 6)):
+        start = rng.randint(0, len(text))
+        end = rng.randint(start, len(text))
+        results.append(RecognizerResult(rng.choice(SpaCy_test.ENTITIES), start, end, round(rng.random(), 1)))
+    return results
+
+
+def anonymize_with(engine, text, results):
+    manager = SpaCy_test.AnonymizationManager()
+    operators = {
+        "DEFAULT": OperatorConfig("placeholder", {"manager": manager}),
+        "INN": OperatorConfig("replace", {"new_value": "<ИНН>"}),
+    }
+    result = engine.anonymize(text=text, analyzer_results=results, operators=operators)
+    return result.text, manager.mapping, [item.to_dict() for item in result.items]
+
+
+class TestJoinAnonymizerEngine:
+    """JoinAnonymizerEngine отдает то же, что штатный AnonymizerEngine"""
+    
+    def test_matches_stock_engine_fuzz(self):
+        stock = AnonymizerEngine()
+        stock.add_anonymizer(SpaCy_test.PlaceholderOperator)
+        join = SpaCy_test.get_anonymizer()
+        
+        rng = random.Random(0)
+        for _ in range(3000):
+            text = "".join(rng.choice("ab  ,.") for _ in range(rng.randint(0, 30)))
+            results = random_results(rng, text)
+            expected = anonymize_with(stock, text, results)
+            assert anonymize_with(join, text, results) == expected, (text, results)
+
+
+class FakeNlpEngine:
+    """process_batch без модели: каждый текст "обрабатывается" cost секунд на часах clock"""
+    
+    def __init__(self, clock, cost):
+        self.clock = clock
+        self.cost = cost
+        self.calls = []
+    
+    def process_batch(self, texts, language, batch_size, n_process):
+        self.calls.append((len(texts), batch_size, n_process))
+        for text in texts:
+            self.clock.now += self.cost
+            yield text, None
+
+
+class TestTunePipe:
+    """Подбор batch_size и n_process укладывается в бюджет времени"""
+    
+    @pytest.fixture
+    def engine(self, monkeypatch, tmp_path):
+        clock = types.SimpleNamespace(now=0.0)
+        clock.perf_counter = lambda: clock.now
+        monkeypatch.setattr(SpaCy_test, "time", clock)
+        monkeypatch.setattr(SpaCy_test, "PIPE_TUNING_PATH", str(tmp_path / "pipe_tuning.json"))
+        monkeypatch.setattr(SpaCy_test.os, "cpu_count", lambda: 8)
+        engine = FakeNlpEngine(clock, cost=0.0)
+        monkeypatch.setattr(SpaCy_test, "get_nlp_engine", lambda: engine)
+        return engine
+    
+    def test_warm_up_and_budget(self, engine):
+        texts = ["текст"] * SpaCy_test.PIPE_TUNING_MIN_TEXTS
+        # Каждый замер выборки занимает 1.5 с: в бюджет 2 с влезают два
+        engine.cost = 1.5 / SpaCy_test.PIPE_TUNING_SAMPLE
+        SpaCy_test.tune_pipe(texts)
+        
+        warm_up, *timed = engine.calls
+        assert warm_up == (SpaCy_test.PIPE_TUNING_BATCH_SIZES[0], SpaCy_test.PIPE_TUNING_BATCH_SIZES[0], 1)
+        assert [call[0] for call in timed] == [SpaCy_test.PIPE_TUNING_SAMPLE] * 2
+        assert all(call[2] == 1 for call in timed)
+    
+    @pytest.mark.parametrize("use_gpu", [False, True])
+    def test_processes_skipped_on_gpu(self, engine, monkeypatch, use_gpu):
+        monkeypatch.setattr(SpaCy_test, "USE_GPU", use_gpu)
+        SpaCy_test.tune_pipe(["текст"] * SpaCy_test.PIPE_TUNING_MIN_TEXTS)
+        
+        process_counts = {call[2] for call in engine.calls}
+        assert process_counts == ({1} if use_gpu else {1, 4, 7})
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])